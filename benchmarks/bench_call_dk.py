@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+call dk 端到端基准测试
+
+在 QT_QPA_PLATFORM=offscreen 下通过 server.launch_calldk_ui 驱动真实的 calldk_ui.py，
+界面通过 CALLDK_AUTO_SUBMIT / CALLDK_AUTO_SUBMIT_IMAGES 自动填入文本和合成图片并提交，
+统计每次调用的各阶段耗时和峰值内存。
+
+默认关闭图片存储和服务器的图片对象缓存，每次调用都经过完整的图片处理和解码；
+--image-cache warm 时使用临时目录中的独立图片存储，预热后的调用测量的是缓存命中。
+
+用法:
+    python benchmarks/bench_call_dk.py --runs 20 --images 3 --image-size 1920x1080
+    python benchmarks/bench_call_dk.py --cold --transport shm --image-format jpeg --json result.json
+    python benchmarks/bench_call_dk.py --image-cache warm
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import tempfile
+from typing import Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# 汇总输出的指标及顺序
+METRICS = ("spawn_ms", "window_ms", "serialize_ms", "decode_ms", "total_ms", "ui_peak_rss_mb", "server_peak_rss_mb")
+
+def _peak_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """进程的峰值常驻内存（MB），pid为None时为当前进程；无法获取时返回None"""
+    if pid is None:
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux下单位为KB，macOS下为字节
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def generate_images(directory: str, count: int, size: str, image_format: str) -> List[str]:
+    """生成合成图片：渐变背景叠加噪声，接近截图和照片混合的压缩特性"""
+    from PIL import Image
+
+    width, height = (int(value) for value in size.lower().split("x"))
+    extension = "jpg" if image_format == "jpeg" else image_format
+    paths = []
+    for index in range(count):
+        gradient = Image.linear_gradient("L").resize((width, height))
+        noise = Image.effect_noise((width, height), 32 + index * 8)
+        img = Image.merge("RGB", (gradient, noise, gradient.rotate(90 * (index % 4)).resize((width, height))))
+        path = os.path.join(directory, f"bench_{index}.{extension}")
+        img.save(path, format=image_format.upper())
+        paths.append(path)
+    return paths
+
+def run_once(server) -> Dict[str, Optional[float]]:
+    """执行一次call dk并返回各阶段指标"""
+    events = {}
+    ui_pid = [None]
+
+    def on_progress(header: dict):
+        now = time.perf_counter()
+        frame_type = header["type"]
+        if frame_type == "ready":
+            ui_pid[0] = header.get("pid")
+            events["ready"] = now
+        elif frame_type == "progress":
+            events.setdefault(header.get("stage"), now)
+        elif frame_type == "done":
+            events["done"] = now
+            events["serialize_ms"] = header.get("timings", {}).get("serialize_ms")
+            # 冷启动模式下界面进程在done之后退出，此时读取峰值内存
+            events["ui_peak_rss_mb"] = _peak_rss_mb(ui_pid[0] or _host_pid(server))
+
+    # 服务器端解码：构建Image对象并转换为MCP图片内容（base64）所花的时间
+    decode_seconds = [0.0]
+    create_image = server._create_image
+
+    def timed_create_image(header: dict, payload: bytes):
+        start = time.perf_counter()
+        image = create_image(header, payload)
+        image.to_image_content()
+        decode_seconds[0] += time.perf_counter() - start
+        return image
+
+    server._create_image = timed_create_image
+    try:
+        start = time.perf_counter()
+        content = server.launch_calldk_ui(".", "benchmark", progress_callback=on_progress)
+        end = time.perf_counter()
+    finally:
+        server._create_image = create_image
+
+    errors = [item for item in content if isinstance(item, str) and item.startswith("图片处理错误")]
+    if errors:
+        raise RuntimeError(errors[0])
+
+    return {
+        "spawn_ms": (events["ready"] - start) * 1000 if "ready" in events else None,
+        "window_ms": (events["shown"] - start) * 1000 if "shown" in events else None,
+        "serialize_ms": events.get("serialize_ms"),
+        "decode_ms": decode_seconds[0] * 1000,
+        "total_ms": (end - start) * 1000,
+        "ui_peak_rss_mb": events.get("ui_peak_rss_mb"),
+        "server_peak_rss_mb": _peak_rss_mb(),
+        "image_count": sum(1 for item in content if not isinstance(item, str)),
+    }
+
+def _host_pid(server) -> Optional[int]:
+    process = server._ui_host._process
+    return process.pid if process is not None else None
+
+def _cpu_seconds(pid: int) -> Optional[float]:
+    """进程累计的CPU时间（用户态+内核态，秒）；无法获取时返回None"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def wait_host_idle(server, quiet: float = 0.5, limit: float = 30.0):
+    """
+    等待常驻宿主空闲：宿主在前几次调用后仍在后台导入提示词优化模块并预热连接，
+    与之重叠的调用会慢一个数量级；CPU时间连续quiet秒不再增长即视为空闲，最多等待limit秒
+    """
+    pid = _host_pid(server)
+    if pid is None:
+        return
+    deadline = time.monotonic() + limit
+    last = _cpu_seconds(pid)
+    if last is None:
+        # 无法读取/proc时退化为固定等待
+        time.sleep(min(limit, 3.0))
+        return
+    while time.monotonic() < deadline:
+        time.sleep(quiet)
+        current = _cpu_seconds(pid)
+        if current is None or current - last < 0.01:
+            return
+        last = current
+
+def summarize(runs: List[Dict[str, Optional[float]]]) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for metric in METRICS:
+        values = sorted(run[metric] for run in runs if run.get(metric) is not None)
+        if not values:
+            continue
+        summary[metric] = {
+            "min": round(values[0], 2),
+            "median": round(statistics.median(values), 2),
+            "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+            "max": round(values[-1], 2),
+        }
+    return summary
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="call dk 端到端基准测试")
+    parser.add_argument("--runs", type=int, default=10, help="计入统计的调用次数")
+    parser.add_argument("--warmup", type=int, default=3, help="不计入统计的预热调用次数，之后等待常驻宿主空闲再开始计时")
+    parser.add_argument("--cold", action="store_true", help="每次调用冷启动界面进程（CALLDK_UI_HOST=false）")
+    parser.add_argument("--transport", choices=("pipe", "shm"), help="图片传输方式，默认使用CALLDK_IMAGE_TRANSPORT")
+    parser.add_argument("--text", default="benchmark call dk", help="自动提交的文本")
+    parser.add_argument("--images", type=int, default=2, help="每次提交的合成图片数量")
+    parser.add_argument("--image-size", default="1280x720", help="合成图片尺寸，WIDTHxHEIGHT")
+    parser.add_argument("--image-format", choices=("png", "jpeg", "webp", "bmp"), default="png", help="合成图片格式")
+    parser.add_argument("--image-cache", choices=("off", "warm"), default="off",
+                        help="off：关闭图片存储和图片对象缓存，测量完整的图片处理；warm：测量重复图片的缓存命中")
+    parser.add_argument("--json", metavar="PATH", help="将每次调用的数据和汇总写入JSON文件")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.environ["CALLDK_AUTO_SUBMIT"] = args.text
+
+    with tempfile.TemporaryDirectory(prefix="calldk_bench_") as directory:
+        image_paths = generate_images(directory, args.images, args.image_size, args.image_format)
+        os.environ["CALLDK_AUTO_SUBMIT_IMAGES"] = os.pathsep.join(image_paths)
+        # 界面进程从环境变量读取图片存储配置，不读写用户自己的存储
+        if args.image_cache == "warm":
+            os.environ["CALLDK_IMAGE_STORE_ENABLED"] = "true"
+            os.environ["CALLDK_IMAGE_STORE_PATH"] = os.path.join(directory, "image_store.sqlite3")
+        else:
+            os.environ["CALLDK_IMAGE_STORE_ENABLED"] = "false"
+
+        import server
+        server.USE_UI_HOST = not args.cold
+        if args.transport:
+            server.IMAGE_TRANSPORT = args.transport
+        if args.image_cache == "off":
+            server._image_cache = server.ImageObjectCache(0)
+
+        try:
+            for _ in range(args.warmup):
+                run_once(server)
+            wait_host_idle(server)
+            runs = [run_once(server) for _ in range(args.runs)]
+        finally:
+            server._ui_host.stop()
+
+    summary = summarize(runs)
+    config = {
+        "mode": "cold" if args.cold else "warm",
+        "transport": server.IMAGE_TRANSPORT,
+        "images": args.images,
+        "image_size": args.image_size,
+        "image_format": args.image_format,
+        "image_cache": args.image_cache,
+        "runs": args.runs,
+    }
+
+    print(json.dumps(config, ensure_ascii=False))
+    print(f"{'指标':<20}{'min':>10}{'median':>10}{'p95':>10}{'max':>10}")
+    for metric, stats in summary.items():
+        print(f"{metric:<20}{stats['min']:>10}{stats['median']:>10}{stats['p95']:>10}{stats['max']:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "summary": summary, "runs": runs}, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
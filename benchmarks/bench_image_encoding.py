@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+图片编码基准测试
+
+对样本图片分别以PNG、JPEG、WebP（有损/无损）和AVIF编码，统计每种格式的编码耗时和字节数，
+并给出CALLDK_IMAGE_ENCODING=auto时为每张图片选择的编码。未指定样本目录时生成合成截图和照片。
+
+用法:
+    python benchmarks/bench_image_encoding.py --screenshots 5 --photos 3
+    python benchmarks/bench_image_encoding.py --corpus ~/Pictures/screenshots --quality 80 --json result.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import tempfile
+from typing import Dict, List, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# (名称, 格式, 是否无损)
+ENCODINGS = (
+    ("png", "png", True),
+    ("jpeg", "jpeg", False),
+    ("webp", "webp", False),
+    ("webp_lossless", "webp", True),
+    ("avif", "avif", False),
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".tiff", ".avif")
+
+def generate_screenshot(path: str, width: int, height: int, seed: int):
+    """生成类似代码编辑器的合成截图：纯色背景、侧边栏和多行彩色文本"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (30, 30, 36))
+    draw = ImageDraw.Draw(img)
+    sidebar = width // 6
+    draw.rectangle((0, 0, sidebar, height), fill=(45, 45, 52))
+    draw.rectangle((0, 0, width, 28), fill=(60, 60, 70))
+    palette = [(220, 220, 220), (86, 156, 214), (206, 145, 120), (106, 153, 85), (197, 134, 192)]
+    for row in range(36, height - 16, 18):
+        draw.text((8, row), f"file_{rng.randint(0, 999)}.py", fill=(180, 180, 180))
+        x = sidebar + 40
+        for _ in range(rng.randint(2, 8)):
+            word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz_()") for _ in range(rng.randint(2, 12)))
+            draw.text((x, row), word, fill=rng.choice(palette))
+            x += 7 * len(word) + 7
+    img.save(path, format="PNG")
+
+def generate_photo(path: str, width: int, height: int, seed: int):
+    """生成类似照片的合成图片：平滑渐变叠加噪声，颜色数量很多"""
+    from PIL import Image, ImageFilter
+
+    gradient = Image.linear_gradient("L").resize((width, height))
+    channels = [
+        Image.blend(gradient.rotate(90 * ((seed + i) % 4)).resize((width, height)),
+                    Image.effect_noise((width, height), 48 + 16 * i), 0.35)
+        for i in range(3)
+    ]
+    Image.merge("RGB", channels).filter(ImageFilter.GaussianBlur(1)).save(path, format="PNG")
+
+def load_corpus(args, directory: str) -> List[str]:
+    if args.corpus:
+        corpus = os.path.expanduser(args.corpus)
+        return sorted(
+            os.path.join(corpus, name) for name in os.listdir(corpus)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    width, height = (int(value) for value in args.size.lower().split("x"))
+    paths = []
+    for index in range(args.screenshots):
+        path = os.path.join(directory, f"screenshot_{index}.png")
+        generate_screenshot(path, width, height, index)
+        paths.append(path)
+    for index in range(args.photos):
+        path = os.path.join(directory, f"photo_{index}.png")
+        generate_photo(path, width, height, index)
+        paths.append(path)
+    return paths
+
+def bench_image(path: str, quality: int, repeat: int) -> Tuple[Dict[str, Dict[str, float]], str]:
+    """返回(各编码的耗时和字节数, auto选择的编码)"""
+    from PIL import Image
+    from image_processing import ImagePolicy, _encode_image, _flatten_to_rgb, _format_supported, choose_output_format
+
+    with Image.open(path) as img:
+        img.load()
+        policy = ImagePolicy(max_side=0, max_image_bytes=0, max_total_bytes=0, encoding="auto",
+                             quality=quality, accepted_formats=["png", "jpeg", "webp"])
+        auto_format, auto_lossless = choose_output_format(img, policy)
+        auto = f"{auto_format}{'_lossless' if auto_lossless and auto_format == 'webp' else ''}"
+
+        results = {}
+        for name, image_format, lossless in ENCODINGS:
+            if not _format_supported(image_format):
+                continue
+            source = _flatten_to_rgb(img) if image_format == "jpeg" else img
+            timings = []
+            data = b""
+            for _ in range(repeat):
+                start = time.perf_counter()
+                data = _encode_image(source, image_format, None if lossless else quality, lossless)
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = {"encode_ms": round(statistics.median(timings), 2), "bytes": len(data)}
+    return results, auto
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="图片编码基准测试")
+    parser.add_argument("--corpus", help="样本图片目录，未指定时生成合成截图和照片")
+    parser.add_argument("--screenshots", type=int, default=4, help="合成截图数量")
+    parser.add_argument("--photos", type=int, default=2, help="合成照片数量")
+    parser.add_argument("--size", default="1920x1080", help="合成图片尺寸，WIDTHxHEIGHT")
+    parser.add_argument("--quality", type=int, default=85, help="有损编码质量")
+    parser.add_argument("--repeat", type=int, default=3, help="每种编码重复次数（取中位数）")
+    parser.add_argument("--json", metavar="PATH", help="将每张图片的数据和汇总写入JSON文件")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="calldk_encoding_") as directory:
+        paths = load_corpus(args, directory)
+        if not paths:
+            print("没有找到样本图片", file=sys.stderr)
+            return 1
+        images = []
+        for path in paths:
+            results, auto = bench_image(path, args.quality, args.repeat)
+            images.append({"file": os.path.basename(path), "auto": auto, "results": results})
+
+    names = [name for name, _, _ in ENCODINGS if any(name in image["results"] for image in images)]
+    print(f"{'图片':<20}{'auto':>15}" + "".join(f"{name:>24}" for name in names))
+    for image in images:
+        cells = []
+        for name in names:
+            result = image["results"].get(name)
+            cells.append(f"{result['bytes'] // 1024:>10} KB {result['encode_ms']:>8.1f} ms" if result else f"{'-':>24}")
+        print(f"{image['file']:<20}{image['auto']:>15}" + "".join(f"{cell:>24}" for cell in cells))
+
+    # 汇总：总字节数相对PNG的比例和编码耗时中位数
+    summary = {}
+    png_total = sum(image["results"]["png"]["bytes"] for image in images)
+    for name in names:
+        measured = [image["results"][name] for image in images if name in image["results"]]
+        total = sum(result["bytes"] for result in measured)
+        summary[name] = {
+            "total_bytes": total,
+            "ratio_to_png": round(total / png_total, 3) if png_total else None,
+            "median_encode_ms": round(statistics.median(result["encode_ms"] for result in measured), 2),
+        }
+    print(f"\n{'编码':<16}{'总字节':>14}{'相对PNG':>10}{'编码耗时中位数':>16}")
+    for name, stats in summary.items():
+        print(f"{name:<16}{stats['total_bytes']:>14}{stats['ratio_to_png']:>10}{stats['median_encode_ms']:>14} ms")
+
+    if args.json:
+        config = {"corpus": args.corpus or "synthetic", "quality": args.quality, "repeat": args.repeat}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "summary": summary, "images": images}, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
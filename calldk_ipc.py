@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+call dk 进程间通信模块
+服务器与界面宿主进程之间基于长度前缀帧的流式通信协议
+"""
+
+import json
+import struct
+from typing import List, Optional, Tuple, TypedDict
+
+from image_processing import ImageData
+
+# 帧头：JSON头长度 + 二进制负载长度（均为4字节大端无符号整数）
+_FRAME_HEADER = struct.Struct(">II")
+
+# 单帧大小上限，防止损坏的数据导致分配巨量内存
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+class CalldkResult(TypedDict):
+    """一次call dk的结果，各响应后端（图形界面、终端）共用"""
+    interactive_calldk: str
+    images: List[ImageData]
+
+class FrameError(Exception):
+    """帧格式错误"""
+
+def write_frame(stream, header: dict, payload: bytes = b"") -> None:
+    """
+    写入一帧
+
+    Args:
+        stream: 二进制可写流
+        header: 帧头，必须包含type字段
+        payload: 可选的二进制负载
+    """
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    stream.write(_FRAME_HEADER.pack(len(header_bytes), len(payload)))
+    stream.write(header_bytes)
+    if payload:
+        stream.write(payload)
+    stream.flush()
+
+def _read_exact(stream, size: int) -> Optional[bytes]:
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+def read_frame(stream) -> Optional[Tuple[dict, bytes]]:
+    """
+    读取一帧
+
+    Args:
+        stream: 二进制可读流
+
+    Returns:
+        (帧头, 负载)，流结束时返回None
+
+    Raises:
+        FrameError: 帧格式错误或帧在中途被截断
+    """
+    prefix = _read_exact(stream, _FRAME_HEADER.size)
+    if prefix is None:
+        return None
+
+    header_size, payload_size = _FRAME_HEADER.unpack(prefix)
+    if header_size + payload_size > MAX_FRAME_SIZE:
+        raise FrameError(f"帧过大: {header_size + payload_size} 字节")
+
+    header_bytes = _read_exact(stream, header_size)
+    payload = _read_exact(stream, payload_size) if payload_size else b""
+    if header_bytes is None or payload is None:
+        raise FrameError("帧数据不完整")
+
+    try:
+        header = json.loads(header_bytes.decode("utf-8"))
+    except ValueError as e:
+        raise FrameError(f"帧头解析失败: {e}")
+
+    if not isinstance(header, dict) or "type" not in header:
+        raise FrameError("帧头缺少type字段")
+    return header, payload
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+call dk 调用指标模块
+记录每次call dk各阶段的耗时和负载大小，输出为JSON行和Prometheus文本格式
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 各阶段耗时字段，同时作为Prometheus指标的stage标签
+STAGES = ("spawn_ms", "shown_ms", "response_ms", "serialize_ms", "receive_ms", "decode_ms", "total_ms")
+
+class CallMetrics:
+    """
+    单次call dk的指标
+
+    耗时均以毫秒为单位，无法测量的阶段为None：
+    - spawn_ms: 本次调用启动界面宿主进程的时间（复用宿主时为None）
+    - shown_ms: 从发起调用到窗口显示
+    - response_ms: 窗口显示到用户提交或关闭（用户思考时间，由界面测量）
+    - serialize_ms: 界面回传结果的时间（由界面测量）
+    - receive_ms: 服务器从收到第一个结果帧到收到完成帧（取代原先读取结果JSON文件的时间）
+    - decode_ms: 服务器构建所有图片对象的时间，每张图片的耗时见images
+    - total_ms: 整次调用
+    """
+
+    def __init__(self, backend: str, transport: str, label: str = ""):
+        self.backend = backend
+        self.transport = transport
+        self.label = label
+        self.timestamp = time.time()
+        self._start = time.perf_counter()
+        self._first_result_at: Optional[float] = None
+        self.stages: Dict[str, Optional[float]] = dict.fromkeys(STAGES)
+        self.images: List[Dict] = []
+        self.text_length = 0
+        self.outcome = "ok"
+        self.error = ""
+
+    def _since_start_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def on_frame(self, header: dict):
+        """处理宿主的ready、progress和done帧头"""
+        frame_type = header.get("type")
+        if frame_type == "ready":
+            self.stages["spawn_ms"] = self._since_start_ms()
+        elif frame_type == "progress" and header.get("stage") == "shown":
+            self.stages["shown_ms"] = self._since_start_ms()
+        elif frame_type == "done":
+            timings = header.get("timings", {})
+            self.stages["response_ms"] = timings.get("response_ms")
+            self.stages["serialize_ms"] = timings.get("serialize_ms")
+            if self._first_result_at is not None:
+                self.stages["receive_ms"] = (time.perf_counter() - self._first_result_at) * 1000
+
+    def on_text(self, text: str):
+        self._first_result_at = self._first_result_at or time.perf_counter()
+        self.text_length = len(text)
+
+    def on_image(self, mime_type: str, size: int, decode_ms: float):
+        self._first_result_at = self._first_result_at or time.perf_counter()
+        self.images.append({"mime_type": mime_type, "bytes": size, "decode_ms": round(decode_ms, 3)})
+        self.stages["decode_ms"] = (self.stages["decode_ms"] or 0.0) + decode_ms
+
+    def finish(self, outcome: str = "ok", error: str = ""):
+        self.outcome = outcome
+        self.error = error
+        self.stages["total_ms"] = self._since_start_ms()
+
+    def to_dict(self) -> dict:
+        record = {
+            "event": "call_dk",
+            "timestamp": self.timestamp,
+            "backend": self.backend,
+            "transport": self.transport,
+            "outcome": self.outcome,
+            "text_length": self.text_length,
+            "image_count": len(self.images),
+            "image_bytes": sum(image["bytes"] for image in self.images),
+            "images": self.images,
+        }
+        record.update({stage: None if ms is None else round(ms, 3) for stage, ms in self.stages.items()})
+        if self.label:
+            record["label"] = self.label
+        if self.error:
+            record["error"] = self.error
+        return record
+
+class MetricsRecorder:
+    """
+    将调用指标追加写入JSON行文件，并维护Prometheus文本格式文件
+
+    Prometheus文件适用于node_exporter的textfile collector，
+    每次调用结束后整体重写（先写临时文件再替换，避免读到半个文件）。
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None, prom_path: Optional[str] = None):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[str, str], int] = {}  # (backend, outcome) -> 调用次数
+        self._stage_sum: Dict[str, float] = dict.fromkeys(STAGES, 0.0)  # 阶段 -> 耗时总和（秒）
+        self._stage_count: Dict[str, int] = dict.fromkeys(STAGES, 0)
+        self._images = 0
+        self._image_bytes = 0
+        self._text_chars = 0
+
+    @classmethod
+    def from_environment(cls) -> "MetricsRecorder":
+        jsonl_path = os.getenv("CALLDK_METRICS_FILE")
+        prom_path = os.getenv("CALLDK_METRICS_PROM_FILE")
+        return cls(
+            os.path.expanduser(jsonl_path) if jsonl_path else None,
+            os.path.expanduser(prom_path) if prom_path else None
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.jsonl_path or self.prom_path)
+
+    def record(self, metrics: CallMetrics):
+        if not self.enabled:
+            return
+        record = metrics.to_dict()
+        with self._lock:
+            try:
+                if self.jsonl_path:
+                    self._append_jsonl(record)
+                if self.prom_path:
+                    self._update_totals(record)
+                    self._write_prometheus()
+            except OSError as e:
+                print(f"写入call dk指标失败: {e}", file=sys.stderr)
+
+    def _append_jsonl(self, record: dict):
+        directory = os.path.dirname(self.jsonl_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.jsonl_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _update_totals(self, record: dict):
+        key = (record["backend"], record["outcome"])
+        self._calls[key] = self._calls.get(key, 0) + 1
+        for stage in STAGES:
+            if record[stage] is not None:
+                self._stage_sum[stage] += record[stage] / 1000
+                self._stage_count[stage] += 1
+        self._images += record["image_count"]
+        self._image_bytes += record["image_bytes"]
+        self._text_chars += record["text_length"]
+
+    def _write_prometheus(self):
+        lines = [
+            "# HELP calldk_calls_total call dk调用次数",
+            "# TYPE calldk_calls_total counter",
+        ]
+        for (backend, outcome), count in sorted(self._calls.items()):
+            lines.append(f'calldk_calls_total{{backend="{backend}",outcome="{outcome}"}} {count}')
+
+        lines += [
+            "# HELP calldk_stage_seconds call dk各阶段耗时",
+            "# TYPE calldk_stage_seconds summary",
+        ]
+        for stage in STAGES:
+            name = stage[:-len("_ms")]
+            lines.append(f'calldk_stage_seconds_sum{{stage="{name}"}} {self._stage_sum[stage]:.6f}')
+            lines.append(f'calldk_stage_seconds_count{{stage="{name}"}} {self._stage_count[stage]}')
+
+        for metric, help_text, value in (
+            ("calldk_images_total", "回传的图片数量", self._images),
+            ("calldk_image_bytes_total", "回传的图片总字节数", self._image_bytes),
+            ("calldk_text_chars_total", "回传的文本总字符数", self._text_chars),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter", f"{metric} {value}"]
+
+        directory = os.path.dirname(self.prom_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.prom_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.prom_path)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+call dk 终端响应后端
+在控制终端上以文本方式收集call dk，不导入Qt，适用于无图形环境或SSH远程开发
+"""
+
+import os
+import sys
+import time
+import shlex
+import select
+import argparse
+import threading
+from typing import List, Optional, TextIO, Tuple
+
+from calldk_ipc import CalldkResult
+from image_processing import (
+    ImageData, ImagePolicy, ImageProcessingError,
+    process_image_file, apply_total_budget, load_image_policy
+)
+
+# 同一时间只能有一个call dk占用终端
+_terminal_lock = threading.Lock()
+
+# 等待终端和输入期间检查调用是否已被取消的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.1
+
+HELP_TEXT = """\
+逐行输入call dk内容，输入空行提交。
+  /image <路径>   附加图片（相对路径基于项目目录，可多次使用）
+  /images         查看已附加的图片
+  /remove <序号>  移除已附加的图片
+  /cancel         放弃本次call dk，返回空结果
+"""
+
+class TerminalUnavailableError(Exception):
+    """没有可用的控制终端"""
+
+class _Cancelled(Exception):
+    """调用已被放弃（cancel_event被设置）"""
+
+def _poll_wait(deadline: Optional[float], cancel_event: Optional[threading.Event]) -> Optional[float]:
+    """
+    下一次等待的时长（秒），None表示可以一直阻塞
+
+    Raises:
+        _Cancelled: cancel_event已被设置
+        TimeoutError: 已超过截止时间（time.monotonic()）
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise _Cancelled()
+    wait = None
+    if deadline is not None:
+        wait = deadline - time.monotonic()
+        if wait <= 0:
+            raise TimeoutError("call dk等待超时")
+    if cancel_event is not None:
+        wait = CANCEL_POLL_INTERVAL if wait is None else min(wait, CANCEL_POLL_INTERVAL)
+    return wait
+
+def _acquire_terminal(deadline: Optional[float], cancel_event: Optional[threading.Event]):
+    """等待其他call dk释放终端，等待时间计入本次调用的截止时间"""
+    while True:
+        wait = _poll_wait(deadline, cancel_event)
+        if _terminal_lock.acquire(timeout=-1 if wait is None else wait):
+            return
+
+def _open_terminal() -> Tuple[TextIO, TextIO]:
+    """打开控制终端，返回(输入流, 输出流)；不使用进程自身的stdin/stdout（MCP通信占用）"""
+    try:
+        if os.name == "nt":
+            return open("CONIN$", "r", encoding="utf-8"), open("CONOUT$", "w", encoding="utf-8")
+        return open("/dev/tty", "r", encoding="utf-8"), open("/dev/tty", "w", encoding="utf-8")
+    except OSError as e:
+        raise TerminalUnavailableError(f"无法打开控制终端: {e}")
+
+def _resolve_path(path: str, project_directory: str) -> str:
+    path = os.path.expanduser(path)
+    if not os.path.isabs(path):
+        path = os.path.join(project_directory, path)
+    return os.path.normpath(path)
+
+def _attach_image(argument: str, project_directory: str, policy: ImagePolicy,
+                  images: List[ImageData], output: TextIO):
+    try:
+        paths = shlex.split(argument, posix=os.name != "nt")
+    except ValueError as e:
+        output.write(f"路径解析失败: {e}\n")
+        return
+    if not paths:
+        output.write("用法: /image <路径>\n")
+        return
+
+    for path in paths:
+        file_path = _resolve_path(path, project_directory)
+        if not os.path.isfile(file_path):
+            output.write(f"文件不存在: {file_path}\n")
+            continue
+        try:
+            image_data = process_image_file(file_path, policy)
+            if any(image.get('sha256') == image_data['sha256'] for image in images):
+                output.write(f"图片 {image_data['filename']} 与已附加的图片相同，已跳过\n")
+                continue
+            used_bytes = sum(len(image['data']) for image in images)
+            image_data = apply_total_budget(image_data, policy, used_bytes)
+        except (ImageProcessingError, OSError) as e:
+            output.write(f"{e}\n")
+            continue
+        images.append(image_data)
+        output.write(f"已附加图片 {len(images)}: {image_data['filename']} "
+                     f"({image_data['mime_type']}, {len(image_data['data']) // 1024} KB)\n")
+
+def _list_images(images: List[ImageData], output: TextIO):
+    if not images:
+        output.write("尚未附加图片\n")
+    for index, image in enumerate(images, 1):
+        output.write(f"  {index}. {image['filename']} ({image['mime_type']})\n")
+
+def _remove_image(argument: str, images: List[ImageData], output: TextIO):
+    try:
+        image = images.pop(int(argument) - 1)
+        output.write(f"已移除图片: {image['filename']}\n")
+    except (ValueError, IndexError):
+        output.write("用法: /remove <序号>，序号见 /images\n")
+
+class _LineReader:
+    """
+    支持截止时间和取消的终端行读取
+
+    POSIX下直接读取文件描述符并自行缓存，避免文本流内部缓冲了粘贴的多行内容后
+    select仍然阻塞；Windows控制台不支持select，通过msvcrt逐字符轮询并自行回显。
+    读取不会无限期阻塞，调用被放弃后线程能及时释放终端。
+    """
+
+    def __init__(self, terminal_in: TextIO):
+        self.terminal_in = terminal_in
+        self.buffer = b""
+        self.console_line = ""  # Windows下尚未提交的输入
+
+    def readline(self, deadline: Optional[float], cancel_event: Optional[threading.Event] = None) -> str:
+        """
+        读取一行，输入结束时返回空字符串
+
+        Raises:
+            TimeoutError: 超过截止时间（time.monotonic()）
+            _Cancelled: cancel_event被设置
+        """
+        if os.name == "nt":
+            return self._read_console_line(deadline, cancel_event)
+
+        fd = self.terminal_in.fileno()
+        while b"\n" not in self.buffer:
+            wait = _poll_wait(deadline, cancel_event)
+            if wait is not None:
+                readable, _, _ = select.select([fd], [], [], wait)
+                if not readable:
+                    continue
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                line, self.buffer = self.buffer, b""
+                return line.decode("utf-8", errors="replace")
+            self.buffer += chunk
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return (line + b"\n").decode("utf-8", errors="replace")
+
+    def _read_console_line(self, deadline: Optional[float], cancel_event: Optional[threading.Event]) -> str:
+        import msvcrt
+
+        while True:
+            while not msvcrt.kbhit():
+                wait = _poll_wait(deadline, cancel_event)
+                time.sleep(CANCEL_POLL_INTERVAL if wait is None else min(wait, CANCEL_POLL_INTERVAL))
+            char = msvcrt.getwch()
+            if char in ("\r", "\n"):
+                msvcrt.putwch("\r")
+                msvcrt.putwch("\n")
+                line, self.console_line = self.console_line, ""
+                return line + "\n"
+            if char == "\x1a":
+                # Ctrl+Z：输入结束
+                line, self.console_line = self.console_line, ""
+                return line
+            if char == "\x03":
+                raise _Cancelled()
+            if char in ("\x00", "\xe0"):
+                # 方向键等功能键由两个字符组成，忽略
+                msvcrt.getwch()
+            elif char == "\b":
+                if self.console_line:
+                    self.console_line = self.console_line[:-1]
+                    for echo in ("\b", " ", "\b"):
+                        msvcrt.putwch(echo)
+            else:
+                self.console_line += char
+                msvcrt.putwch(char)
+
+def tty_calldk(project_directory: str, prompt: str, image_policy: Optional[ImagePolicy] = None,
+               timeout: float = 0, cancel_event: Optional[threading.Event] = None) -> CalldkResult:
+    """
+    在控制终端上收集call dk
+
+    Args:
+        project_directory: 项目目录，图片相对路径以此为基准
+        prompt: 显示给用户的提示信息
+        image_policy: 图片负载预算，None时使用.env中的配置
+        timeout: 等待用户输入的最长时间（秒，包含等待其他call dk释放终端的时间），0表示一直等待
+        cancel_event: 被设置时放弃本次call dk并释放终端，返回空结果
+
+    Returns:
+        与图形界面相同结构的call dk结果
+
+    Raises:
+        TerminalUnavailableError: 没有可用的控制终端
+        TimeoutError: 超过timeout秒仍未提交
+    """
+    policy = image_policy or load_image_policy()
+    deadline = time.monotonic() + timeout if timeout > 0 else None
+    lines: List[str] = []
+    images: List[ImageData] = []
+
+    try:
+        _acquire_terminal(deadline, cancel_event)
+    except _Cancelled:
+        return CalldkResult(interactive_calldk="", images=[])
+
+    try:
+        terminal_in, output = _open_terminal()
+        reader = _LineReader(terminal_in)
+        try:
+            output.write(f"\n===== call dk ({project_directory}) =====\n")
+            if prompt:
+                output.write(f"{prompt}\n")
+            output.write(HELP_TEXT)
+            if deadline is not None:
+                output.write(f"请在{round(timeout, 1):g}秒内提交，超时后本次call dk将结束\n")
+
+            while True:
+                output.write("> ")
+                output.flush()
+                try:
+                    line = reader.readline(deadline, cancel_event)
+                except TimeoutError:
+                    output.write("\n已超时\n")
+                    raise
+                except _Cancelled:
+                    output.write("\n本次call dk已被取消\n")
+                    return CalldkResult(interactive_calldk="", images=[])
+                if not line:
+                    # 终端输入结束（Ctrl+D / Ctrl+Z），提交已输入的内容
+                    break
+                line = line.rstrip("\r\n")
+
+                command, _, argument = line.strip().partition(" ")
+                if command == "/image":
+                    _attach_image(argument.strip(), project_directory, policy, images, output)
+                elif command == "/images":
+                    _list_images(images, output)
+                elif command == "/remove":
+                    _remove_image(argument.strip(), images, output)
+                elif command == "/cancel":
+                    output.write("已放弃本次call dk\n")
+                    return CalldkResult(interactive_calldk="", images=[])
+                elif not line.strip():
+                    if lines or images:
+                        break
+                else:
+                    lines.append(line)
+
+            output.write("已提交\n")
+            output.flush()
+        finally:
+            terminal_in.close()
+            output.close()
+    finally:
+        _terminal_lock.release()
+
+    return CalldkResult(interactive_calldk="\n".join(lines).strip(), images=images)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the call dk terminal prompt")
+    parser.add_argument("--project-directory", default=os.getcwd(), help="项目目录，图片相对路径以此为基准")
+    parser.add_argument("--prompt", default="我已实现您请求的更改。", help="显示给用户的提示信息")
+    args = parser.parse_args()
+
+    result = tty_calldk(args.project_directory, args.prompt)
+    print(f"\n收到的call dk:\n{result['interactive_calldk']}")
+    if result['images']:
+        print(f"\n附加图片: {len(result['images'])} 张")
+        for i, img in enumerate(result['images']):
+            print(f"  {i+1}. {img['filename']} ({img['mime_type']})")
+    sys.exit(0)
@@ -8,21 +8,44 @@ import argparse
 # 移除了subprocess和threading导入
 import hashlib
 import base64
-import io
-from typing import Optional, TypedDict, List
-
-from PySide6.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QPushButton, QTextEdit, QGroupBox,
-    QFileDialog, QScrollArea, QFrame, QMessageBox
-)
-from PySide6.QtCore import Qt, QSettings, QThread, Signal, QPropertyAnimation, QEasingCurve, QTimer
-from PySide6.QtGui import QIcon, QKeyEvent, QPalette, QColor, QPixmap
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, List
+
+# 启动性能分析需在导入PySide6之前开始计时
+from startup_profiler import StartupProfiler
+_startup_profiler = StartupProfiler.from_environment()
+
+# 首次绘制之前只导入构建窗口所需的模块，
+# asyncio、PIL和提示词优化模块在窗口显示后按需加载
+with _startup_profiler.measure("import_pyside6"):
+    from PySide6.QtWidgets import (
+        QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
+        QLabel, QPushButton, QTextEdit, QGroupBox,
+        QFileDialog, QScrollArea, QFrame, QMessageBox
+    )
+    from PySide6.QtCore import Qt, QSettings, QThread, Signal, QPropertyAnimation, QEasingCurve, QTimer
+    from PySide6.QtGui import QIcon, QKeyEvent, QPalette, QColor, QPixmap, QTextCursor
+
+with _startup_profiler.measure("import_local_modules"):
+    from calldk_ipc import CalldkResult, read_frame, write_frame, FrameError
+    from image_processing import (
+        ImageData, ImagePolicy,
+        process_image_file, apply_total_budget, load_image_policy
+    )
+    from image_store import get_image_store, image_sha256, make_thumbnail
 
 # 提示词优化模块将异步加载
 OPTIMIZER_AVAILABLE = False
 _optimizer_module = None
 
+# 流式优化时编辑器的最小刷新间隔
+STREAM_REPAINT_INTERVAL_MS = 50
+
+# 截止时间倒计时剩余不足此秒数时以醒目颜色提示
+COUNTDOWN_WARNING_SECONDS = 30
+
 # PIL模块按需加载 - 优化启动性能
 PIL_AVAILABLE = False
 _pil_image_module = None
@@ -66,6 +89,34 @@ def get_pil_imageqt():
         _load_pil_modules()
     return _pil_imageqt_module
 
+# 缩略图缓存：图片内容哈希 -> QPixmap，避免重复解码和缩放
+THUMBNAIL_CACHE_SIZE = 64
+_thumbnail_cache: "OrderedDict[str, QPixmap]" = OrderedDict()
+
+def get_thumbnail_pixmap(image_data: ImageData) -> Optional[QPixmap]:
+    """获取图片缩略图，依次查找内存缓存和图片存储，都未命中时才解码，失败时返回None"""
+    key = image_data.get('sha256') or image_sha256(image_data['data'])
+    pixmap = _thumbnail_cache.get(key)
+    if pixmap is not None:
+        _thumbnail_cache.move_to_end(key)
+        return pixmap
+
+    store = get_image_store()
+    thumbnail = store.get_thumbnail(key) if store is not None else None
+    if not thumbnail:
+        try:
+            thumbnail, _, _ = make_thumbnail(image_data['data'])
+        except Exception:
+            return None
+
+    pixmap = QPixmap()
+    if not pixmap.loadFromData(thumbnail):
+        return None
+    _thumbnail_cache[key] = pixmap
+    while len(_thumbnail_cache) > THUMBNAIL_CACHE_SIZE:
+        _thumbnail_cache.popitem(last=False)
+    return pixmap
+
 class CollapsibleImageSection(QFrame):
     """可折叠的图片功能区域"""
 
@@ -175,6 +226,11 @@ class CollapsibleImageSection(QFrame):
         self.clear_images_button.clicked.connect(self._clear_images)
         button_layout.addWidget(self.clear_images_button)
 
+        self.cancel_ingest_button = QPushButton("取消处理")
+        self.cancel_ingest_button.clicked.connect(self._cancel_ingest)
+        self.cancel_ingest_button.setVisible(False)
+        button_layout.addWidget(self.cancel_ingest_button)
+
         button_layout.addStretch()
         content_layout.addLayout(button_layout)
 
@@ -256,6 +312,18 @@ class CollapsibleImageSection(QFrame):
         if self.parent_ui:
             self.parent_ui._clear_images_from_collapsible()
 
+    def _cancel_ingest(self):
+        """取消图片处理 - 委托给父UI处理"""
+        if self.parent_ui:
+            self.parent_ui._cancel_image_ingest()
+
+    def set_ingest_running(self, running: bool):
+        """切换图片处理中的按钮状态"""
+        if hasattr(self, 'cancel_ingest_button'):
+            self.add_image_button.setEnabled(not running)
+            self.clear_images_button.setEnabled(not running)
+            self.cancel_ingest_button.setVisible(running)
+
     def update_image_status(self, message: str):
         """更新图片状态"""
         if hasattr(self, 'image_status_label'):
@@ -267,15 +335,6 @@ class CollapsibleImageSection(QFrame):
             return self.image_preview_layout
         return None
 
-class ImageData(TypedDict):
-    filename: str
-    data: str  # Base64编码的图片数据
-    mime_type: str  # 图片MIME类型
-
-class CalldkResult(TypedDict):
-    interactive_calldk: str
-    images: List[ImageData]
-
 # 移除了命令相关的配置
 
 def set_dark_title_bar(widget: QWidget, dark_title_bar: bool) -> None:
@@ -380,30 +439,239 @@ def get_optimizer_status():
         return "提示词优化模块尚未加载"
     return _optimizer_module.get_optimizer_status()
 
-class OptimizeThread(QThread):
-    """提示词优化线程"""
-    finished = Signal(str)
-    error = Signal(str)
+class OptimizerWorker(QThread):
+    """
+    长期运行的提示词优化工作线程
+
+    线程内运行一个asyncio事件循环，所有优化请求都作为该循环中的任务执行，
+    可随时取消，取消会立即中断底层的网络请求。进程内所有窗口共用一个实例（见get_optimizer_worker）。
+    """
+    chunk_received = Signal(int, str)  # 请求ID, 流式模式下的增量文本
+    result_ready = Signal(int, str)  # 请求ID, 优化结果
+    failed = Signal(int, str)  # 请求ID, 错误消息
+    warmed = Signal(float, str)  # 预热耗时（秒）, 错误消息（成功时为空）
 
-    def __init__(self, input_text):
+    def __init__(self):
         super().__init__()
-        self.input_text = input_text
+        self.loop = None
+        self._loop_ready = threading.Event()
+        self._futures = {}  # 请求ID -> concurrent.futures.Future
+        self._next_id = 0
+        self.warm_result = None  # 最近一次预热的(耗时, 错误消息)，供之后打开的窗口显示
 
     def run(self):
+        import asyncio
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._loop_ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            # 取消仍未完成的任务后关闭循环
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.close()
+
+    def submit(self, input_text: str, stream: Optional[bool] = None) -> int:
+        """提交优化请求，返回请求ID；stream为None时使用优化器的配置"""
+        import asyncio
+
+        self._loop_ready.wait()
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.run_coroutine_threadsafe(self._optimize(request_id, input_text, stream), self.loop)
+        self._futures[request_id] = future
+        future.add_done_callback(lambda _, rid=request_id: self._futures.pop(rid, None))
+        return request_id
+
+    def warm_up(self, keepalive_interval: float = 0):
+        """预热连接；keepalive_interval大于0时在窗口生命周期内定期保活"""
+        import asyncio
+
+        self._loop_ready.wait()
+        asyncio.run_coroutine_threadsafe(self._warm_up(keepalive_interval), self.loop)
+
+    async def _warm_up(self, keepalive_interval: float):
+        import asyncio
+
+        optimizer = get_optimizer()
+        try:
+            self.warm_result = (await optimizer.warm_up_async(), "")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.warm_result = (0.0, str(e) or e.__class__.__name__)
+        self.warmed.emit(*self.warm_result)
+
+        while keepalive_interval > 0:
+            await asyncio.sleep(keepalive_interval)
+            try:
+                await optimizer.warm_up_async()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+
+    def cancel(self, request_id: Optional[int]):
+        """取消请求，被取消的请求不会再发出任何信号"""
+        future = self._futures.get(request_id)
+        if future is not None:
+            future.cancel()
+
+    def stop(self):
+        """取消所有请求并停止事件循环"""
+        if not self.isRunning():
+            return
+        self._loop_ready.wait()
+        for future in list(self._futures.values()):
+            future.cancel()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.wait(2000)
+
+    async def _optimize(self, request_id: int, input_text: str, stream: Optional[bool]):
+        import asyncio
+
         try:
             if not OPTIMIZER_AVAILABLE:
-                self.error.emit("提示词优化模块不可用")
+                self.failed.emit(request_id, "提示词优化模块不可用")
                 return
 
             optimizer = get_optimizer()
             if not optimizer.is_available():
-                self.error.emit(optimizer.get_status_message())
+                self.failed.emit(request_id, optimizer.get_status_message())
                 return
 
-            result = optimizer.optimize_prompt(self.input_text)
-            self.finished.emit(result)
+            if optimizer.stream if stream is None else stream:
+                result = await asyncio.wait_for(
+                    self._consume_stream(request_id, optimizer, input_text),
+                    timeout=optimizer.timeout
+                )
+            else:
+                result = await optimizer.optimize_prompt_async(input_text)
+            self.result_ready.emit(request_id, result)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.failed.emit(request_id, "提示词优化超时")
         except Exception as e:
-            self.error.emit(str(e))
+            self.failed.emit(request_id, str(e))
+
+    async def _consume_stream(self, request_id: int, optimizer, input_text: str) -> str:
+        parts = []
+        async for text in optimizer.optimize_prompt_stream_async(input_text):
+            parts.append(text)
+            self.chunk_received.emit(request_id, text)
+        return "".join(parts).strip()
+
+_optimizer_worker = None
+
+def get_optimizer_worker() -> OptimizerWorker:
+    """
+    获取进程内共享的优化工作线程，首次调用时启动并按配置预热连接
+
+    google-genai的异步客户端绑定到第一次使用它的事件循环，循环关闭后客户端不可再用，
+    所以所有窗口（包括宿主回收复用的窗口）共用同一个事件循环，应用退出时才停止。
+    """
+    global _optimizer_worker
+    if _optimizer_worker is None:
+        _optimizer_worker = OptimizerWorker()
+        _optimizer_worker.start()
+        QApplication.instance().aboutToQuit.connect(_optimizer_worker.stop)
+
+        optimizer = get_optimizer()
+        if optimizer.prewarm:
+            _optimizer_worker.warm_up(optimizer.keepalive_interval)
+    return _optimizer_worker
+
+class ImageIngestThread(QThread):
+    """在线程池中并行处理图片文件，按选择顺序回传结果"""
+    image_ready = Signal(object)  # ImageData
+    image_failed = Signal(str)  # 错误消息
+    image_duplicate = Signal(str)  # 与已选图片内容相同而跳过的文件名
+    progress = Signal(int, int, str)  # 已完成数量, 总数, 文件名
+
+    def __init__(self, file_paths: List[str], policy: Optional[ImagePolicy] = None, used_bytes: int = 0,
+                 known_hashes: Optional[set] = None):
+        super().__init__()
+        self.file_paths = list(file_paths)
+        self.policy = policy
+        self.used_bytes = used_bytes  # 已选图片占用的字节数，用于总预算
+        self.known_hashes = set(known_hashes or ())  # 已选图片的内容哈希，用于去重
+        self._cancelled = False
+
+    def _apply_total_budget(self, image_data: ImageData) -> ImageData:
+        """按选择顺序扣减总预算，超出剩余预算的图片继续压缩"""
+        image_data = apply_total_budget(image_data, self.policy, self.used_bytes)
+        self.used_bytes += len(image_data['data'])
+        return image_data
+
+    def cancel(self):
+        self._cancelled = True
+        self.requestInterruption()
+
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        total = len(self.file_paths)
+        max_workers = max(1, min(total, os.cpu_count() or 1))
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {
+                executor.submit(process_image_file, file_path, self.policy): index
+                for index, file_path in enumerate(self.file_paths)
+            }
+            results = {}
+            next_index = 0
+            done = 0
+            for future in as_completed(futures):
+                if self._cancelled:
+                    break
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = None
+                    self.image_failed.emit(str(e))
+
+                done += 1
+                self.progress.emit(done, total, os.path.basename(self.file_paths[index]))
+
+                # 只回传已连续完成的前缀，保证合并顺序与选择顺序一致
+                while next_index in results:
+                    image_data = results.pop(next_index)
+                    next_index += 1
+                    if image_data is None:
+                        continue
+                    # 内容相同的图片只保留第一张，不占用总预算
+                    if image_data['sha256'] in self.known_hashes:
+                        self.image_duplicate.emit(image_data['filename'])
+                        continue
+                    self.known_hashes.add(image_data['sha256'])
+                    try:
+                        image_data = self._apply_total_budget(image_data)
+                        self.known_hashes.add(image_data['sha256'])
+                        self.image_ready.emit(image_data)
+                    except Exception as e:
+                        self.image_failed.emit(str(e))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+_detached_threads = set()  # 窗口关闭时仍在运行的线程，结束前保持引用
+
+def _delete_when_finished(thread: QThread):
+    """线程结束后再删除；直接删除仍在运行的QThread会导致Qt中止进程"""
+    def release():
+        _detached_threads.discard(thread)
+        thread.deleteLater()
+
+    _detached_threads.add(thread)
+    thread.finished.connect(release)
+    if thread.isFinished():
+        release()
 
 class CalldkTextEdit(QTextEdit):
     def __init__(self, parent=None):
@@ -434,6 +702,9 @@ class CalldkTextEdit(QTextEdit):
 # 移除了LogSignals类
 
 class CalldkUI(QMainWindow):
+    # 窗口关闭（提交或直接关闭）时发出，供常驻宿主回传结果
+    calldk_closed = Signal()
+
     def __init__(self, project_directory: str, prompt: str):
         super().__init__()
         self.project_directory = project_directory
@@ -443,13 +714,34 @@ class CalldkUI(QMainWindow):
 
         # 图片相关变量
         self.selected_images: List[ImageData] = []
-        self.image_preview_widgets: List[QLabel] = []
+        self.image_preview_widgets: List[QFrame] = []  # 与selected_images一一对应
+        self.image_ingest_thread = None  # 后台图片处理线程
+        self.image_ingest_failures: List[str] = []
+        self.image_ingest_duplicates: List[str] = []
+        self.image_policy: ImagePolicy = load_image_policy()  # 图片负载预算，可由每次请求覆盖
 
         # 提示词优化相关变量
-        self.optimize_thread = None
+        self.optimizer_worker = None  # 长期运行的优化工作线程
+        self.optimize_request_id = None  # 正在进行的Ctrl+Q优化请求
+        self.optimize_button_idle_tooltip = "使用AI优化当前输入的提示词 (Ctrl+Q)"
         self.original_text_before_optimize = ""  # 用于撤销功能
+        self.optimize_stream_started = False  # 本次优化是否已开始流式输出
+        self.optimize_stream_buffer = ""  # 尚未刷新到编辑器的增量文本
+
+        # 预测式优化：停止输入后在后台预先优化当前文本
+        self.speculative_enabled = False
+        self.speculative_request_id = None  # 正在进行的预测式优化请求
+        self.speculative_input = ""  # 正在进行或已完成的预测式优化的输入
+        self.speculative_result = None  # 已完成的预测式优化结果
+        self.apply_speculative_on_finish = False  # 用户已按Ctrl+Q，预测完成后直接应用
+        self.suppress_speculative = False  # 程序写入文本时不触发预测
         self.optimizer_loader_thread = None  # 异步加载线程
 
+        # 自动提交：窗口显示后自动填入文本和图片并提交，用于无人值守的基准测试
+        self.auto_submit_text = os.getenv("CALLDK_AUTO_SUBMIT")  # 未设置时不启用
+        self.auto_submit_images = [path for path in os.getenv("CALLDK_AUTO_SUBMIT_IMAGES", "").split(os.pathsep) if path]
+        self.auto_submit_pending = False  # 等待图片处理完成后提交
+
         self.setWindowTitle("call dk")
         script_dir = os.path.dirname(os.path.abspath(__file__))
         icon_path = os.path.join(script_dir, "images", "feedback.png")
@@ -490,7 +782,26 @@ class CalldkUI(QMainWindow):
         self.settings.endGroup() # 结束 "MainWindow_General" 组
         
         # 渐进式启动：分阶段加载界面
-        self._create_ui()
+        with _startup_profiler.measure("create_ui"):
+            self._create_ui()
+
+        # 流式优化时合并增量文本，限制编辑器重绘频率
+        self.optimize_stream_timer = QTimer(self)
+        self.optimize_stream_timer.setSingleShot(True)
+        self.optimize_stream_timer.setInterval(STREAM_REPAINT_INTERVAL_MS)
+        self.optimize_stream_timer.timeout.connect(self._flush_optimize_stream)
+
+        # 请求截止时间倒计时
+        self.deadline = None  # time.monotonic()截止时间，None表示不限时
+        self.countdown_timer = QTimer(self)
+        self.countdown_timer.setInterval(1000)
+        self.countdown_timer.timeout.connect(self._update_countdown)
+
+        # 输入防抖，停止输入一段时间后再发起预测式优化
+        self.speculative_timer = QTimer(self)
+        self.speculative_timer.setSingleShot(True)
+        self.speculative_timer.timeout.connect(self._start_speculative_optimize)
+        self.calldk_text.textChanged.connect(self._on_calldk_text_changed)
 
         # 第一阶段：立即应用基础样式
         set_dark_title_bar(self, True)
@@ -546,6 +857,12 @@ class CalldkUI(QMainWindow):
         self.image_preview_layout = QHBoxLayout(self.image_preview_widget)
         self.image_preview_layout.setAlignment(Qt.AlignLeft)
         
+        # 截止时间倒计时，仅在请求设置了超时时显示
+        self.countdown_label = QLabel()
+        self.countdown_label.setStyleSheet("color: #888888; font-size: 9pt;")
+        self.countdown_label.hide()
+
+        calldk_layout.addWidget(self.countdown_label)
         calldk_layout.addWidget(self.calldk_text)
         calldk_layout.addWidget(self.image_section)
 
@@ -596,20 +913,92 @@ class CalldkUI(QMainWindow):
         """启动异步加载提示词优化模块"""
         self.optimizer_loader_thread = OptimizerLoaderThread()
         self.optimizer_loader_thread.loaded.connect(self._on_optimizer_loaded)
+        self.optimizer_loader_thread.finished.connect(self._on_optimizer_loader_finished)
         self.optimizer_loader_thread.start()
 
     def _on_optimizer_loaded(self, success: bool, message: str):
         """处理优化器加载完成事件"""
         if success:
+            self._start_optimizer_worker()
+            optimizer = get_optimizer()
+            self.speculative_enabled = optimizer.speculative
+            self.speculative_timer.setInterval(optimizer.speculative_delay_ms)
             self.optimize_button.setText("🚀 提示词优化 (Ctrl+Q)")
             self.optimize_button.setEnabled(True)
-            self.optimize_button.setToolTip("使用AI优化当前输入的提示词 (Ctrl+Q)")
+            self.optimize_button.setToolTip(self.optimize_button_idle_tooltip)
         else:
             self.optimize_button.setText("❌ 优化不可用 (Ctrl+Q)")
             self.optimize_button.setEnabled(False)
             self.optimize_button.setToolTip(message)
 
-        # 清理线程
+    def _start_optimizer_worker(self):
+        """连接进程内共享的优化工作线程，各窗口按请求ID区分自己的结果"""
+        if self.optimizer_worker is not None:
+            return
+        self.optimizer_worker = get_optimizer_worker()
+        self.optimizer_worker.chunk_received.connect(self._on_worker_chunk)
+        self.optimizer_worker.result_ready.connect(self._on_worker_result)
+        self.optimizer_worker.failed.connect(self._on_worker_failed)
+        self.optimizer_worker.warmed.connect(self._on_optimizer_warmed)
+        if self.optimizer_worker.warm_result is not None:
+            self._on_optimizer_warmed(*self.optimizer_worker.warm_result)
+
+    def _on_optimizer_warmed(self, elapsed: float, error: str):
+        """连接预热完成，在按钮提示中显示耗时"""
+        if error:
+            self.optimize_button_idle_tooltip = f"使用AI优化当前输入的提示词 (Ctrl+Q)\n连接预热失败: {error}"
+        else:
+            self.optimize_button_idle_tooltip = f"使用AI优化当前输入的提示词 (Ctrl+Q)\n连接预热耗时 {elapsed * 1000:.0f} ms"
+        if self.optimize_button.isEnabled() and self.optimize_request_id is None:
+            self.optimize_button.setToolTip(self.optimize_button_idle_tooltip)
+
+    def detach_optimizer_worker(self):
+        """取消本窗口的优化请求并断开与共享工作线程的连接，工作线程继续服务其他窗口"""
+        if self.optimizer_worker is None:
+            return
+        self._cancel_optimize_requests()
+        self.optimizer_worker.chunk_received.disconnect(self._on_worker_chunk)
+        self.optimizer_worker.result_ready.disconnect(self._on_worker_result)
+        self.optimizer_worker.failed.disconnect(self._on_worker_failed)
+        self.optimizer_worker.warmed.disconnect(self._on_optimizer_warmed)
+        self.optimizer_worker = None
+
+    def _cancel_optimize_requests(self):
+        """取消进行中的优化请求（窗口关闭或请求被放弃时）"""
+        if self.optimizer_worker is not None:
+            self.optimizer_worker.cancel(self.optimize_request_id)
+            self.optimizer_worker.cancel(self.speculative_request_id)
+        if self.optimize_request_id is not None and self.optimize_stream_started:
+            self.calldk_text.setPlainText(self.original_text_before_optimize)
+            self.original_text_before_optimize = ""
+            self._end_optimize_stream()
+        if self.optimize_request_id is not None or self.apply_speculative_on_finish:
+            self._restore_optimize_button()
+        self.optimize_request_id = None
+        self.speculative_request_id = None
+        self.speculative_input = ""
+        self.apply_speculative_on_finish = False
+
+    def _on_worker_chunk(self, request_id: int, text: str):
+        if request_id == self.optimize_request_id:
+            self._on_optimize_chunk(text)
+
+    def _on_worker_result(self, request_id: int, result: str):
+        if request_id == self.optimize_request_id:
+            self.optimize_request_id = None
+            self._on_optimize_finished(result)
+        elif request_id == self.speculative_request_id:
+            self._on_speculative_finished(result)
+
+    def _on_worker_failed(self, request_id: int, error: str):
+        if request_id == self.optimize_request_id:
+            self.optimize_request_id = None
+            self._on_optimize_error(error)
+        elif request_id == self.speculative_request_id:
+            self._on_speculative_error(error)
+
+    def _on_optimizer_loader_finished(self):
+        """加载线程真正结束后再清理，loaded信号发出时run()尚未返回"""
         if self.optimizer_loader_thread:
             self.optimizer_loader_thread.deleteLater()
             self.optimizer_loader_thread = None
@@ -621,13 +1010,11 @@ class CalldkUI(QMainWindow):
     def _add_image_from_collapsible(self):
         """从折叠式图片区域添加图片"""
         file_dialog = QFileDialog()
-        file_dialog.setNameFilter("图片文件 (*.png *.jpg *.jpeg *.gif *.bmp *.tiff)")
+        file_dialog.setNameFilter("图片文件 (*.png *.jpg *.jpeg *.gif *.bmp *.tiff *.webp *.avif)")
         file_dialog.setFileMode(QFileDialog.ExistingFiles)
 
         if file_dialog.exec():
-            file_paths = file_dialog.selectedFiles()
-            for file_path in file_paths:
-                self._process_image_file(file_path)
+            self._start_image_ingest(file_dialog.selectedFiles())
 
     def _clear_images_from_collapsible(self):
         """从折叠式图片区域清除图片"""
@@ -650,154 +1037,159 @@ class CalldkUI(QMainWindow):
             return
 
         file_dialog = QFileDialog()
-        file_dialog.setNameFilter("图片文件 (*.png *.jpg *.jpeg *.gif *.bmp *.tiff)")
+        file_dialog.setNameFilter("图片文件 (*.png *.jpg *.jpeg *.gif *.bmp *.tiff *.webp *.avif)")
         file_dialog.setFileMode(QFileDialog.ExistingFiles)
 
         if file_dialog.exec():
-            file_paths = file_dialog.selectedFiles()
-            for file_path in file_paths:
-                self._process_image_file(file_path)
+            self._start_image_ingest(file_dialog.selectedFiles())
     
-    def _process_image_file(self, file_path: str):
-        """处理单个图片文件"""
-        try:
-            # 检查文件大小（限制为10MB）
-            file_size = os.path.getsize(file_path)
-            if file_size > 10 * 1024 * 1024:  # 10MB
-                QMessageBox.warning(self, "文件过大", f"图片文件 {os.path.basename(file_path)} 超过10MB限制。")
-                return
+    def _start_image_ingest(self, file_paths: List[str]):
+        """在后台线程池中并行处理选中的图片文件"""
+        if not file_paths:
+            return
+        if self.image_ingest_thread and self.image_ingest_thread.isRunning():
+            QMessageBox.information(self, "提示", "正在处理上一批图片，请稍候或先取消")
+            return
+
+        self.image_ingest_failures = []
+        self.image_ingest_duplicates = []
+        used_bytes = sum(len(image['data']) for image in self.selected_images)
+        known_hashes = {image.get('sha256') or image_sha256(image['data']) for image in self.selected_images}
+        self.image_ingest_thread = ImageIngestThread(file_paths, self.image_policy, used_bytes, known_hashes)
+        self.image_ingest_thread.image_ready.connect(self._on_image_ingested)
+        self.image_ingest_thread.image_failed.connect(self._on_image_ingest_failed)
+        self.image_ingest_thread.image_duplicate.connect(self._on_image_duplicate)
+        self.image_ingest_thread.progress.connect(self._on_image_ingest_progress)
+        self.image_ingest_thread.finished.connect(self._on_image_ingest_finished)
+        self.image_section.set_ingest_running(True)
+        self.image_section.update_image_status(f"正在处理图片 0/{len(file_paths)}...")
+        self.image_ingest_thread.start()
+
+    def _cancel_image_ingest(self):
+        """取消正在进行的图片处理"""
+        if self.image_ingest_thread and self.image_ingest_thread.isRunning():
+            self.image_ingest_thread.cancel()
+
+    def _on_image_ingested(self, image_data: ImageData):
+        """图片处理完成（按选择顺序回调）"""
+        # 忽略已被取消的旧批次在队列中残留的结果
+        if self.sender() is not self.image_ingest_thread:
+            return
+        self.selected_images.append(image_data)
+        self._add_image_preview(image_data)
+
+    def _on_image_ingest_failed(self, message: str):
+        # 已取消或窗口已关闭的旧批次的失败不计入当前批次
+        if self.sender() is self.image_ingest_thread:
+            self.image_ingest_failures.append(message)
+
+    def _on_image_duplicate(self, filename: str):
+        if self.sender() is self.image_ingest_thread:
+            self.image_ingest_duplicates.append(filename)
+
+    def _on_image_ingest_progress(self, done: int, total: int, filename: str):
+        self.image_section.update_image_status(f"正在处理图片 {done}/{total}: {filename}")
+
+    def _on_image_ingest_finished(self):
+        """整批图片处理结束"""
+        if self.sender() is not self.image_ingest_thread:
+            return
+        thread = self.image_ingest_thread
+        self.image_ingest_thread = None
+        self.image_section.set_ingest_running(False)
+        self._update_image_status()
+        if self.image_ingest_duplicates:
+            self.image_section.update_image_status(
+                f"已选择 {len(self.selected_images)} 张图片（跳过 {len(self.image_ingest_duplicates)} 张重复图片）"
+            )
+            self.image_ingest_duplicates = []
+
+        if self.auto_submit_pending:
+            # 自动提交时不弹出模态对话框，失败信息输出到stderr
+            self.auto_submit_pending = False
+            for message in self.image_ingest_failures:
+                print(message, file=sys.stderr)
+            self.image_ingest_failures = []
+            self._submit_calldk()
+        elif self.image_ingest_failures:
+            QMessageBox.warning(self, "错误", "以下图片处理失败：\n" + "\n".join(self.image_ingest_failures))
+            self.image_ingest_failures = []
+
+        if thread:
+            thread.deleteLater()
 
-            # 获取文件格式
-            file_format = os.path.splitext(file_path)[1].lower().replace('.', '')
-            if not file_format:
-                file_format = 'jpeg'  # 默认格式
-
-            # 使用按需加载的PIL打开图片
-            Image = get_pil_image()
-            with Image.open(file_path) as img:
-                # 保持原始格式，只转换不支持的格式
-                output_format = file_format
-                mime_type = f'image/{file_format}'
-
-                # 如果不是常见格式，转为PNG
-                if file_format not in ('jpeg', 'jpg', 'png', 'gif', 'bmp', 'webp'):
-                    output_format = 'png'
-                    mime_type = 'image/png'
-
-                # 保留原始尺寸，不压缩
-                
-                # 根据格式保存图片
-                buffer = io.BytesIO()
-                if output_format.lower() in ('jpg', 'jpeg'):
-                    # JPEG不支持透明度，需要特殊处理
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        background = Image.new('RGB', img.size, (255, 255, 255))
-                        if img.mode == 'P':
-                            img = img.convert('RGBA')
-                        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                        img = background
-                    elif img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    img.save(buffer, format='JPEG', quality=100)  # 使用最高质量
-                else:
-                    # 对于PNG等支持透明度的格式，保留原始模式
-                    img.save(buffer, format=output_format.upper())
-
-                img_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-
-                # 创建图片数据对象
-                image_data = ImageData(
-                    filename=os.path.basename(file_path),
-                    data=img_data,
-                    mime_type=mime_type
-                )
-                
-                self.selected_images.append(image_data)
-                self._update_image_preview()
-                
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"处理图片时出错: {str(e)}")
-    
     def _clear_images(self):
         """清除所有图片"""
         self.selected_images.clear()
-        self._update_image_preview()
-    
-    def _update_image_preview(self):
-        """更新图片预览区域"""
-        # 清除现有预览
         for widget in self.image_preview_widgets:
             widget.deleteLater()
         self.image_preview_widgets.clear()
+        self._update_image_status()
 
-        # 获取正确的预览布局
-        preview_layout = self.image_preview_layout
+    def _get_preview_layout(self):
+        """获取正确的预览布局"""
         if hasattr(self, 'image_section') and self.image_section.get_image_preview_layout():
-            preview_layout = self.image_section.get_image_preview_layout()
-
-        # 添加新的预览
-        for i, image_data in enumerate(self.selected_images):
-            preview_frame = QFrame()
-            preview_frame.setFrameStyle(QFrame.Box)
-            preview_frame.setMaximumSize(120, 100)
-            preview_frame.setMinimumSize(120, 100)
-
-            frame_layout = QVBoxLayout(preview_frame)
-            frame_layout.setContentsMargins(5, 5, 5, 5)
-
-            # 创建缩略图
-            try:
-                Image = get_pil_image()
-                ImageQt = get_pil_imageqt()
-
-                img_bytes = base64.b64decode(image_data['data'])
-                img = Image.open(io.BytesIO(img_bytes))
-                img.thumbnail((100, 70), Image.Resampling.LANCZOS)
-
-                # 转换为QPixmap
-                qt_img = ImageQt.ImageQt(img)
-                pixmap = QPixmap.fromImage(qt_img)
-
-                img_label = QLabel()
-                img_label.setPixmap(pixmap)
-                img_label.setAlignment(Qt.AlignCenter)
-                img_label.setScaledContents(True)
-
-                frame_layout.addWidget(img_label)
-
-            except Exception:
-                error_label = QLabel("预览失败")
-                error_label.setAlignment(Qt.AlignCenter)
-                frame_layout.addWidget(error_label)
-
-            # 文件名标签
-            name_label = QLabel(image_data['filename'])
-            name_label.setWordWrap(True)
-            name_label.setAlignment(Qt.AlignCenter)
-            name_label.setStyleSheet("font-size: 8pt;")
-            frame_layout.addWidget(name_label)
-
-            # 删除按钮
-            remove_button = QPushButton("×")
-            remove_button.setMaximumSize(20, 20)
-            remove_button.clicked.connect(lambda _, idx=i: self._remove_image(idx))
-            frame_layout.addWidget(remove_button)
-
-            preview_layout.addWidget(preview_frame)
-            self.image_preview_widgets.append(preview_frame)
-
-        # 更新状态标签
+            return self.image_section.get_image_preview_layout()
+        return self.image_preview_layout
+
+    def _add_image_preview(self, image_data: ImageData):
+        """只为新增的图片创建预览控件"""
+        preview_frame = QFrame()
+        preview_frame.setFrameStyle(QFrame.Box)
+        preview_frame.setMaximumSize(120, 100)
+        preview_frame.setMinimumSize(120, 100)
+
+        frame_layout = QVBoxLayout(preview_frame)
+        frame_layout.setContentsMargins(5, 5, 5, 5)
+
+        # 创建缩略图（命中缓存时无需重新解码）
+        pixmap = get_thumbnail_pixmap(image_data)
+        if pixmap is not None:
+            img_label = QLabel()
+            img_label.setPixmap(pixmap)
+            img_label.setAlignment(Qt.AlignCenter)
+            img_label.setScaledContents(True)
+            frame_layout.addWidget(img_label)
+        else:
+            error_label = QLabel("预览失败")
+            error_label.setAlignment(Qt.AlignCenter)
+            frame_layout.addWidget(error_label)
+
+        # 文件名标签
+        name_label = QLabel(image_data['filename'])
+        name_label.setWordWrap(True)
+        name_label.setAlignment(Qt.AlignCenter)
+        name_label.setStyleSheet("font-size: 8pt;")
+        frame_layout.addWidget(name_label)
+
+        # 删除按钮，按控件而不是按索引定位，避免删除其他图片后索引失效
+        remove_button = QPushButton("×")
+        remove_button.setMaximumSize(20, 20)
+        remove_button.clicked.connect(lambda _, frame=preview_frame: self._remove_image_by_widget(frame))
+        frame_layout.addWidget(remove_button)
+
+        self._get_preview_layout().addWidget(preview_frame)
+        self.image_preview_widgets.append(preview_frame)
+
+    def _update_image_status(self):
+        """更新状态标签"""
         count = len(self.selected_images)
         status_text = f"已选择 {count} 张图片" if count > 0 else "未选择图片"
         self.image_status_label.setText(status_text)
         if hasattr(self, 'image_section'):
             self.image_section.update_image_status(status_text)
-    
+
+    def _remove_image_by_widget(self, widget: QFrame):
+        """删除预览控件对应的图片"""
+        if widget in self.image_preview_widgets:
+            self._remove_image(self.image_preview_widgets.index(widget))
+
     def _remove_image(self, index: int):
-        """删除指定索引的图片"""
+        """删除指定索引的图片，只销毁对应的预览控件"""
         if 0 <= index < len(self.selected_images):
             self.selected_images.pop(index)
-            self._update_image_preview()
+            self.image_preview_widgets.pop(index).deleteLater()
+            self._update_image_status()
 
     def _optimize_prompt(self):
         """优化提示词"""
@@ -807,40 +1199,155 @@ class CalldkUI(QMainWindow):
             QMessageBox.warning(self, "提示", "请先输入要优化的提示词")
             return
 
-        if not OPTIMIZER_AVAILABLE:
+        if not OPTIMIZER_AVAILABLE or self.optimizer_worker is None:
             QMessageBox.warning(self, "错误", "提示词优化功能不可用，请检查相关依赖是否已安装")
             return
 
+        if self.optimize_request_id is not None:
+            return
+
+        # 预测式优化已完成且输入未变，直接应用结果
+        if self.speculative_result and self.speculative_result[0] == input_text:
+            self._on_optimize_finished(self.speculative_result[1])
+            return
+
         # 禁用按钮，显示处理状态
         self.optimize_button.setEnabled(False)
         self.optimize_button.setText("🧠 优化中...")
 
-        # 创建并启动优化线程
-        self.optimize_thread = OptimizeThread(input_text)
-        self.optimize_thread.finished.connect(self._on_optimize_finished)
-        self.optimize_thread.error.connect(self._on_optimize_error)
-        self.optimize_thread.start()
+        # 相同输入的预测式优化仍在进行，完成后直接应用
+        if self.speculative_request_id is not None and self.speculative_input == input_text:
+            self.apply_speculative_on_finish = True
+            return
+
+        # 其他输入的预测已无用，立即取消以释放连接
+        self._discard_speculative_request()
+
+        # 提交到优化工作线程
+        self.optimize_stream_started = False
+        self.optimize_stream_buffer = ""
+        self.optimize_request_id = self.optimizer_worker.submit(input_text)
+
+    def _on_calldk_text_changed(self):
+        """输入变化时使旧的预测失效并重新开始防抖计时"""
+        if not self.speculative_enabled or self.suppress_speculative or self.optimize_stream_started:
+            return
+        if self.calldk_text.toPlainText().strip() != self.speculative_input:
+            self.speculative_result = None
+            if not self.apply_speculative_on_finish:
+                # 进行中的预测已过期，立即中止
+                self._discard_speculative_request()
+        self.speculative_timer.start()
+
+    def _start_speculative_optimize(self):
+        """输入停顿后在后台优化当前文本"""
+        input_text = self.calldk_text.toPlainText().strip()
+        if not input_text or self.optimizer_worker is None or input_text == self.speculative_input:
+            return
+        if self.optimize_request_id is not None:
+            return
+
+        self._discard_speculative_request()
+        self.speculative_input = input_text
+        self.speculative_result = None
+        self.speculative_request_id = self.optimizer_worker.submit(input_text, stream=False)
+
+    def _discard_speculative_request(self):
+        """取消过期的预测式优化请求"""
+        if self.speculative_request_id is None:
+            return
+        self.optimizer_worker.cancel(self.speculative_request_id)
+        self.speculative_request_id = None
+        self.speculative_input = ""
+
+    def _on_speculative_finished(self, result: str):
+        self.speculative_request_id = None
+        self.speculative_result = (self.speculative_input, result)
+
+        if self.apply_speculative_on_finish:
+            self.apply_speculative_on_finish = False
+            if self.calldk_text.toPlainText().strip() == self.speculative_input:
+                self._on_optimize_finished(result)
+            else:
+                self._restore_optimize_button()
+
+    def _on_speculative_error(self, error: str):
+        self.speculative_request_id = None
+        self.speculative_input = ""
+
+        if self.apply_speculative_on_finish:
+            # 用户正在等待该结果，按正常优化失败处理
+            self.apply_speculative_on_finish = False
+            self._on_optimize_error(error)
+
+    def _restore_optimize_button(self):
+        self.optimize_button.setEnabled(True)
+        self.optimize_button.setText("🚀 提示词优化 (Ctrl+Q)")
+
+    def _on_optimize_chunk(self, text: str):
+        """流式优化的增量文本回调"""
+        if not self.optimize_stream_started:
+            # 收到第一段输出时保存原始文本用于撤销，并清空输入框
+            self.optimize_stream_started = True
+            self.original_text_before_optimize = self.calldk_text.toPlainText()
+            self.calldk_text.clear()
+            self.calldk_text.setReadOnly(True)
+
+        self.optimize_stream_buffer += text
+        if not self.optimize_stream_timer.isActive():
+            self.optimize_stream_timer.start()
+
+    def _flush_optimize_stream(self):
+        """将缓冲的增量文本追加到输入框末尾"""
+        if not self.optimize_stream_buffer:
+            return
+        cursor = self.calldk_text.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(self.optimize_stream_buffer)
+        self.calldk_text.setTextCursor(cursor)
+        self.optimize_stream_buffer = ""
+
+    def _end_optimize_stream(self):
+        """结束流式输出状态"""
+        self.optimize_stream_timer.stop()
+        self.optimize_stream_buffer = ""
+        self.optimize_stream_started = False
+        self.calldk_text.setReadOnly(False)
 
     def _on_optimize_finished(self, result: str):
         """优化完成回调"""
-        # 保存原始文本用于撤销
-        self.original_text_before_optimize = self.calldk_text.toPlainText()
+        # 写入优化结果不应再触发对结果本身的预测式优化
+        self.suppress_speculative = True
+        if self.optimize_stream_started:
+            # 流式输出已写入输入框，只需以去除首尾空白的完整结果收尾
+            self._flush_optimize_stream()
+            if self.calldk_text.toPlainText() != result:
+                self.calldk_text.setPlainText(result)
+            self._end_optimize_stream()
+        else:
+            # 保存原始文本用于撤销
+            self.original_text_before_optimize = self.calldk_text.toPlainText()
 
-        # 将优化结果替换到输入框
-        self.calldk_text.setPlainText(result)
+            # 将优化结果替换到输入框
+            self.calldk_text.setPlainText(result)
+        self.suppress_speculative = False
 
         # 恢复按钮状态
-        self.optimize_button.setEnabled(True)
-        self.optimize_button.setText("🚀 提示词优化 (Ctrl+Q)")
+        self._restore_optimize_button()
 
         # 显示状态提示（不弹窗）
         self.optimize_button.setToolTip("✅ 优化完成！按Ctrl+Z可撤销")
 
     def _on_optimize_error(self, error: str):
         """优化错误回调"""
+        if self.optimize_stream_started:
+            # 流式输出中途失败，恢复用户的原始输入
+            self.calldk_text.setPlainText(self.original_text_before_optimize)
+            self.original_text_before_optimize = ""
+            self._end_optimize_stream()
+
         # 恢复按钮状态
-        self.optimize_button.setEnabled(True)
-        self.optimize_button.setText("🚀 提示词优化 (Ctrl+Q)")
+        self._restore_optimize_button()
 
         # 显示错误消息
         QMessageBox.critical(self, "优化失败", f"提示词优化失败：\n{error}")
@@ -853,11 +1360,57 @@ class CalldkUI(QMainWindow):
             # 清空保存的原始文本
             self.original_text_before_optimize = ""
             # 更新按钮提示
-            self.optimize_button.setToolTip("使用AI优化当前输入的提示词 (Ctrl+Q)")
+            self.optimize_button.setToolTip(self.optimize_button_idle_tooltip)
         else:
             # 如果没有可撤销的内容，显示提示
             self.optimize_button.setToolTip("没有可撤销的优化操作")
 
+    def reset_for_request(self, project_directory: str, prompt: str, image_policy: Optional[ImagePolicy] = None,
+                          label: str = "", timeout_seconds: float = 0):
+        """为新的call dk请求重置窗口状态（常驻宿主复用窗口时使用）"""
+        # 多个客户端共用宿主时在标题中标明请求来源
+        self.setWindowTitle(f"call dk - {label}" if label else "call dk")
+        self.set_deadline(timeout_seconds)
+        self.project_directory = project_directory
+        self.prompt = prompt
+        self.image_policy = image_policy or load_image_policy()
+        self.calldk_result = None
+        self.original_text_before_optimize = ""
+        self.speculative_timer.stop()
+        self._cancel_optimize_requests()
+        self.speculative_result = None
+        self.suppress_speculative = True
+        self.calldk_text.clear()
+        self.suppress_speculative = False
+        self._clear_images()
+        self.calldk_text.setFocus()
+
+    def set_deadline(self, timeout_seconds: float):
+        """设置请求截止时间并显示倒计时，0表示不限时"""
+        if timeout_seconds and timeout_seconds > 0:
+            self.deadline = time.monotonic() + timeout_seconds
+            self.countdown_label.show()
+            self._update_countdown()
+            self.countdown_timer.start()
+        else:
+            self.deadline = None
+            self.countdown_timer.stop()
+            self.countdown_label.hide()
+
+    def _update_countdown(self):
+        if self.deadline is None:
+            return
+        remaining = int(self.deadline - time.monotonic() + 0.999)  # 向上取整，避免提前显示0
+        if remaining <= 0:
+            self.countdown_timer.stop()
+            self.countdown_label.setText("⏰ 已超时，服务器将不再等待本次call dk")
+            self.countdown_label.setStyleSheet("color: #ff6b6b; font-size: 9pt;")
+            return
+        minutes, seconds = divmod(remaining, 60)
+        self.countdown_label.setText(f"⏳ 剩余时间 {minutes:02d}:{seconds:02d}")
+        color = "#ffb86c" if remaining <= COUNTDOWN_WARNING_SECONDS else "#888888"
+        self.countdown_label.setStyleSheet(f"color: {color}; font-size: 9pt;")
+
     def _submit_calldk(self):
         self.calldk_result = CalldkResult(
             interactive_calldk=self.calldk_text.toPlainText().strip(),
@@ -868,6 +1421,23 @@ class CalldkUI(QMainWindow):
     # 移除了日志清除和配置保存方法
 
     def closeEvent(self, event):
+        self.countdown_timer.stop()
+
+        # 放弃进行中的优化请求
+        self.speculative_timer.stop()
+        self._cancel_optimize_requests()
+
+        # 取消并等待后台图片处理
+        if self.image_ingest_thread:
+            self.image_ingest_thread.cancel()
+            if self.image_ingest_thread.wait(3000):
+                self.image_ingest_thread.deleteLater()
+            else:
+                # 正在解码的大图片超过等待时间，线程结束后再删除
+                _delete_when_finished(self.image_ingest_thread)
+            self.image_ingest_thread = None
+            self.image_section.set_ingest_running(False)
+
         # 清理异步加载线程
         if self.optimizer_loader_thread and self.optimizer_loader_thread.isRunning():
             self.optimizer_loader_thread.quit()
@@ -879,11 +1449,39 @@ class CalldkUI(QMainWindow):
         self.settings.setValue("windowState", self.saveState())
         self.settings.endGroup()
         super().closeEvent(event)
+        self.calldk_closed.emit()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if _startup_profiler.enabled and not _startup_profiler.reported:
+            _startup_profiler.mark("first_show")
+            # 零延迟定时器在事件循环处理完首次绘制后触发
+            QTimer.singleShot(0, self._on_first_paint)
+        if self.auto_submit_text is not None:
+            QTimer.singleShot(0, self._run_auto_submit)
+
+    def _run_auto_submit(self):
+        """填入CALLDK_AUTO_SUBMIT的文本和CALLDK_AUTO_SUBMIT_IMAGES的图片后提交"""
+        self.suppress_speculative = True
+        self.calldk_text.setPlainText(self.auto_submit_text)
+        self.suppress_speculative = False
+        if self.auto_submit_images:
+            self.auto_submit_pending = True
+            self._start_image_ingest(self.auto_submit_images)
+        else:
+            self._submit_calldk()
+
+    def _on_first_paint(self):
+        _startup_profiler.mark("first_paint")
+        _startup_profiler.report()
 
     def run(self) -> CalldkResult:
         self.show()
         QApplication.instance().exec()
+        return self.get_result()
 
+    def get_result(self) -> CalldkResult:
+        """获取当前请求的结果，未提交时返回空结果"""
         if not self.calldk_result:
             return CalldkResult(
                 interactive_calldk="",
@@ -899,30 +1497,272 @@ def get_project_settings_group(project_dir: str) -> str:
     full_hash = hashlib.md5(project_dir.encode('utf-8')).hexdigest()[:8]
     return f"{basename}_{full_hash}"
 
+def _create_application() -> QApplication:
+    with _startup_profiler.measure("create_application"):
+        app = QApplication.instance() or QApplication()
+        app.setPalette(get_dark_mode_palette(app))
+        app.setStyle("Fusion")
+    return app
+
+def _create_window(project_directory: str, prompt: str) -> "CalldkUI":
+    with _startup_profiler.measure("calldk_ui_init"):
+        return CalldkUI(project_directory, prompt)
+
+def _write_result_file(output_file: str, result: CalldkResult):
+    # 确保目录存在
+    os.makedirs(os.path.dirname(output_file) if os.path.dirname(output_file) else ".", exist_ok=True)
+    # 将结果保存到输出文件，JSON中的图片数据使用base64编码
+    serializable = CalldkResult(
+        interactive_calldk=result["interactive_calldk"],
+        images=[
+            {**image, "data": base64.b64encode(image["data"]).decode("utf-8")}
+            for image in result["images"]
+        ]
+    )
+    with open(output_file, "w") as f:
+        json.dump(serializable, f)
+
 def calldk_ui(project_directory: str, prompt: str, output_file: Optional[str] = None) -> Optional[CalldkResult]:
-    app = QApplication.instance() or QApplication()
-    app.setPalette(get_dark_mode_palette(app))
-    app.setStyle("Fusion")
-    ui = CalldkUI(project_directory, prompt)
+    _create_application()
+    ui = _create_window(project_directory, prompt)
     result = ui.run()
 
     if output_file and result:
-        # 确保目录存在
-        os.makedirs(os.path.dirname(output_file) if os.path.dirname(output_file) else ".", exist_ok=True)
-        # 将结果保存到输出文件
-        with open(output_file, "w") as f:
-            json.dump(result, f)
+        _write_result_file(output_file, result)
         return None
 
     return result
 
+# 宿主保留的空闲窗口数量上限，并发请求结束后多余的窗口会被销毁
+MAX_IDLE_WINDOWS = 1
+
+# 同时显示多个窗口时每个窗口错开的像素
+WINDOW_CASCADE_OFFSET = 30
+
+class HostCommandReader(QThread):
+    """常驻宿主模式下从stdin读取服务器命令帧的线程"""
+    command_received = Signal(dict)
+    channel_closed = Signal()
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def run(self):
+        try:
+            while True:
+                frame = read_frame(self.stream)
+                if frame is None:
+                    break
+                header, _ = frame
+                self.command_received.emit(header)
+        except FrameError:
+            pass
+        self.channel_closed.emit()
+
+class CalldkUIHost:
+    """
+    常驻的call dk界面宿主
+
+    预先创建隐藏的CalldkUI窗口，每次请求时重置并显示，
+    避免每次call dk都重新启动Python、导入PySide6和构建窗口。
+    多个请求同时进行时各自使用独立的窗口，结束后窗口回收复用。
+    与服务器之间通过stdin/stdout上的长度前缀帧通信，
+    结果按"文本帧 -> 逐张图片帧 -> 完成帧"的顺序流式回传。
+
+    图片以原始字节传输，支持两种方式：
+    - pipe: 每张图片作为一帧，字节直接放在帧负载中
+    - shm: 所有图片写入一块共享内存，只通过管道发送偏移/长度清单，
+      服务器拷贝完成后回送release命令再释放共享内存
+    """
+
+    def __init__(self, command_stream, channel):
+        self.channel = channel
+        self.app = _create_application()
+        # 窗口关闭后保持进程存活，等待下一次请求
+        self.app.setQuitOnLastWindowClosed(False)
+
+        self.idle_windows: List[CalldkUI] = [self._new_window()]
+        self.active_requests = {}  # 请求ID -> (show命令, 窗口)
+        self.request_shown_at = {}  # 请求ID -> 窗口显示时间，用于统计用户响应耗时
+        self.pending_shared_memory = {}  # 请求ID -> 等待服务器释放的共享内存
+
+        self.reader = HostCommandReader(command_stream)
+        self.reader.command_received.connect(self._on_command)
+        self.reader.channel_closed.connect(self.app.quit)
+
+    def _send(self, header: dict, payload: bytes = b""):
+        write_frame(self.channel, header, payload)
+
+    def _new_window(self) -> CalldkUI:
+        window = _create_window(os.getcwd(), "")
+        window.calldk_closed.connect(lambda: self._on_window_closed(window))
+        return window
+
+    def _recycle_window(self, window: CalldkUI):
+        """窗口关闭后放回空闲列表，超出上限的窗口直接销毁"""
+        if len(self.idle_windows) < MAX_IDLE_WINDOWS:
+            self.idle_windows.append(window)
+        else:
+            window.detach_optimizer_worker()
+            window.deleteLater()
+
+    def _show_request(self, command: dict):
+        request_id = command.get("id")
+        window = self.idle_windows.pop() if self.idle_windows else self._new_window()
+        others = [other for _, other in self.active_requests.values()]
+        self.active_requests[request_id] = (command, window)
+
+        window.reset_for_request(
+            command.get("project_directory", os.getcwd()),
+            command.get("prompt", ""),
+            command.get("image_policy"),
+            command.get("label", ""),
+            command.get("timeout_seconds", 0)
+        )
+        if others:
+            # 同时显示多个窗口时依次错开，避免完全重叠
+            anchor = others[0].pos()
+            offset = WINDOW_CASCADE_OFFSET * len(others)
+            window.move(anchor.x() + offset, anchor.y() + offset)
+        window.show()
+        window.raise_()
+        window.activateWindow()
+        self.request_shown_at[request_id] = time.perf_counter()
+        self._send({"type": "progress", "id": request_id, "stage": "shown"})
+
+    def _cancel_request(self, request_id):
+        """服务器已放弃该请求：关闭窗口且不回传结果"""
+        entry = self.active_requests.pop(request_id, None)
+        self.request_shown_at.pop(request_id, None)
+        if entry is not None:
+            entry[1].close()
+        # 结果已写入共享内存但服务器在读取前取消或超时，不会再发送release
+        self._release_shared_memory(request_id)
+
+    def _on_command(self, command: dict):
+        command_type = command.get("type")
+        if command_type == "shutdown":
+            self.app.quit()
+        elif command_type == "release":
+            self._release_shared_memory(command.get("id"))
+        elif command_type == "cancel":
+            self._cancel_request(command.get("id"))
+        elif command_type == "show":
+            if command.get("id") in self.active_requests:
+                self._send({"type": "error", "id": command.get("id"), "message": "重复的call dk请求ID"})
+                return
+            self._show_request(command)
+
+    def _on_window_closed(self, window: CalldkUI):
+        request_id = next(
+            (rid for rid, (_, active_window) in self.active_requests.items() if active_window is window),
+            None
+        )
+        if request_id is not None:
+            request, _ = self.active_requests.pop(request_id)
+            self._send_result(request, window)
+        self._recycle_window(window)
+
+    def _send_result(self, request: dict, window: CalldkUI):
+        request_id = request.get("id")
+        try:
+            serialize_start = time.perf_counter()
+            shown_at = self.request_shown_at.pop(request_id, serialize_start)
+            result = window.get_result()
+            images = result["images"]
+            self._send({"type": "text", "id": request_id, "interactive_calldk": result["interactive_calldk"]})
+            if images and request.get("image_transport") == "shm":
+                self._send_images_shared_memory(request_id, images)
+            else:
+                for image_data in images:
+                    self._send(
+                        {"type": "image", "id": request_id, "filename": image_data["filename"],
+                         "mime_type": image_data["mime_type"], "sha256": image_data.get("sha256")},
+                        image_data["data"]
+                    )
+            self._send({
+                "type": "done",
+                "id": request_id,
+                "image_count": len(images),
+                "timings": {
+                    "response_ms": round((serialize_start - shown_at) * 1000, 3),
+                    "serialize_ms": round((time.perf_counter() - serialize_start) * 1000, 3)
+                }
+            })
+        except Exception as e:
+            self._send({"type": "error", "id": request_id, "message": f"回传call dk结果失败: {e}"})
+
+    def _send_images_shared_memory(self, request_id, images: List[ImageData]):
+        """将图片字节写入共享内存，只通过管道发送清单"""
+        from multiprocessing import shared_memory
+
+        total_size = sum(len(image["data"]) for image in images)
+        shm = shared_memory.SharedMemory(create=True, size=total_size)
+        self.pending_shared_memory[request_id] = shm
+
+        entries = []
+        offset = 0
+        for image in images:
+            length = len(image["data"])
+            shm.buf[offset:offset + length] = image["data"]
+            entries.append({
+                "filename": image["filename"],
+                "mime_type": image["mime_type"],
+                "sha256": image.get("sha256"),
+                "offset": offset,
+                "length": length
+            })
+            offset += length
+
+        self._send({"type": "image_manifest", "id": request_id, "shm_name": shm.name, "images": entries})
+
+    def _release_shared_memory(self, request_id=None):
+        """释放服务器已读取完成的共享内存，request_id为None时全部释放"""
+        request_ids = list(self.pending_shared_memory) if request_id is None else [request_id]
+        for rid in request_ids:
+            shm = self.pending_shared_memory.pop(rid, None)
+            if shm is None:
+                continue
+            try:
+                shm.close()
+                shm.unlink()
+            except Exception:
+                pass
+
+    def run(self) -> int:
+        self.reader.start()
+        self._send({"type": "ready", "pid": os.getpid()})
+        # 宿主模式下窗口在首次请求时才显示，就绪即输出报告
+        _startup_profiler.mark("host_ready")
+        _startup_profiler.report(final_mark="host_ready")
+        exit_code = self.app.exec()
+        self.reader.wait(1000)
+        self._release_shared_memory()
+        return exit_code
+
+def run_ui_host() -> int:
+    # stdout作为与服务器通信的通道，其余打印输出统一重定向到stderr
+    sys.stdout.flush()
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    host = CalldkUIHost(sys.stdin.buffer, channel)
+    return host.run()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the call dk UI")
     parser.add_argument("--project-directory", default=os.getcwd(), help="运行命令的项目目录")
     parser.add_argument("--prompt", default="我已实现您请求的更改。", help="显示给用户的提示信息")
     parser.add_argument("--output-file", help="保存call dk结果为JSON的路径")
+    parser.add_argument("--host", action="store_true", help="以宿主模式运行，通过stdin/stdout与服务器进行帧通信")
+    parser.add_argument("--profile-startup", nargs="?", const="1", metavar="PATH",
+                        help="记录启动各阶段耗时，输出到stderr或追加到指定文件（已在导入时解析）")
     args = parser.parse_args()
 
+    if args.host:
+        sys.exit(run_ui_host())
+
     result = calldk_ui(args.project_directory, args.prompt, args.output_file)
     if result:
         print(f"\n收到的call dk:\n{result['interactive_calldk']}")
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""
+图片处理模块
+不依赖Qt的图片读取与编码逻辑，可在后台线程中并行调用
+"""
+
+import io
+import os
+from typing import List, Optional, Tuple, TypedDict
+
+from image_store import get_image_store, image_sha256, make_source_key
+
+# 单个图片文件大小上限
+MAX_IMAGE_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+
+# 服务器可直接接受的图片格式，这些格式的文件无需重新编码
+PASSTHROUGH_FORMATS = ('jpeg', 'png', 'gif', 'bmp', 'webp')
+
+# 是否对已支持的格式跳过解码/重新编码（仅在输出编码为original时生效）
+PASSTHROUGH_ENABLED = os.getenv('CALLDK_IMAGE_PASSTHROUGH', 'true').lower() == 'true'
+
+# 输出编码策略：
+# - original: 保持原始格式，客户端不接受的格式转为PNG
+# - auto: 截图（颜色较少）使用无损WebP，照片使用有损WebP
+# - webp / webp_lossless / avif / jpeg / png: 统一转为指定编码
+# 目标格式不在客户端可接受的格式中时，无损编码退回PNG，有损编码退回JPEG
+IMAGE_ENCODINGS = ('original', 'auto', 'webp', 'webp_lossless', 'avif', 'jpeg', 'png')
+
+# 有损编码的默认质量
+DEFAULT_QUALITY = 85
+
+# 无损WebP的压缩力度（0-100），截图在50时与默认的80大小相近，编码耗时约减半
+WEBP_LOSSLESS_EFFORT = 50
+
+# 截图判定：按最近邻缩小到此边长后统计颜色数，不超过SCREENSHOT_MAX_COLORS时视为截图
+COLOR_SAMPLE_SIDE = 512
+SCREENSHOT_MAX_COLORS = 8192
+
+class _ImageDataBase(TypedDict):
+    filename: str
+    data: bytes  # 原始图片字节
+    mime_type: str  # 图片MIME类型
+
+class ImageData(_ImageDataBase, total=False):
+    sha256: str  # 图片字节的内容哈希，用于去重和缓存
+
+class ImagePolicy(TypedDict):
+    max_side: int  # 单边最大像素，0表示不限制
+    max_image_bytes: int  # 单张图片最大字节数，0表示不限制
+    max_total_bytes: int  # 单次call dk结果中图片总字节数上限，0表示不限制
+    encoding: str  # 输出编码策略，见IMAGE_ENCODINGS
+    quality: int  # 有损编码的质量（1-100）
+    accepted_formats: List[str]  # 客户端可接受的图片格式
+
+class ImageProcessingError(Exception):
+    """图片处理错误，消息可直接展示给用户"""
+
+# 有损格式重新压缩时依次尝试的质量
+QUALITY_STEPS = (90, 80, 70, 60, 50, 40)
+
+# 仍超出字节预算时每次缩小的比例和最多缩小次数
+DOWNSCALE_FACTOR = 0.75
+MAX_DOWNSCALE_STEPS = 6
+
+def load_image_policy(accepted_formats: Optional[List[str]] = None) -> ImagePolicy:
+    """
+    从环境变量（.env）读取图片负载预算和输出编码策略
+
+    Args:
+        accepted_formats: 客户端可接受的图片格式，None时使用CALLDK_CLIENT_IMAGE_FORMATS
+    """
+    encoding = os.getenv('CALLDK_IMAGE_ENCODING', 'original').lower()
+    if encoding not in IMAGE_ENCODINGS:
+        encoding = 'original'
+    if accepted_formats is None:
+        accepted_formats = os.getenv('CALLDK_CLIENT_IMAGE_FORMATS', ','.join(PASSTHROUGH_FORMATS)).split(',')
+    return ImagePolicy(
+        max_side=int(os.getenv('CALLDK_IMAGE_MAX_SIDE', '0')),
+        max_image_bytes=int(os.getenv('CALLDK_IMAGE_MAX_BYTES', '0')),
+        max_total_bytes=int(os.getenv('CALLDK_IMAGE_MAX_TOTAL_BYTES', '0')),
+        encoding=encoding,
+        quality=int(os.getenv('CALLDK_IMAGE_QUALITY', str(DEFAULT_QUALITY))),
+        accepted_formats=normalize_image_formats(accepted_formats)
+    )
+
+def normalize_image_formats(formats: List[str]) -> List[str]:
+    """规范化格式名称（去除image/前缀，jpg视为jpeg），保持顺序并去重"""
+    result = []
+    for image_format in formats:
+        image_format = image_format.strip().lower().split('/')[-1]
+        if image_format == 'jpg':
+            image_format = 'jpeg'
+        if image_format and image_format not in result:
+            result.append(image_format)
+    return result
+
+def _accepted_formats(policy: Optional[ImagePolicy]) -> List[str]:
+    if policy and policy.get('accepted_formats'):
+        return policy['accepted_formats']
+    return list(PASSTHROUGH_FORMATS)
+
+def _encoding(policy: Optional[ImagePolicy]) -> str:
+    return policy.get('encoding', 'original') if policy else 'original'
+
+def _quality(policy: Optional[ImagePolicy]) -> int:
+    return (policy.get('quality') if policy else None) or DEFAULT_QUALITY
+
+def _format_supported(image_format: str) -> bool:
+    """Pillow是否能编码该格式（AVIF/WebP取决于编译选项）"""
+    if image_format in ('webp', 'avif'):
+        from PIL import features
+        return bool(features.check(image_format))
+    return True
+
+def is_screenshot(img) -> bool:
+    """按颜色数量判断是否为截图类图片（界面、文档、图表），照片的颜色通常多得多"""
+    from PIL import Image
+
+    if img.mode in ('1', 'P', 'L', 'LA', 'PA'):
+        return True
+    sample = img
+    if max(img.size) > COLOR_SAMPLE_SIDE:
+        ratio = COLOR_SAMPLE_SIDE / max(img.size)
+        sample = img.resize(
+            (max(1, int(img.width * ratio)), max(1, int(img.height * ratio))), Image.Resampling.NEAREST
+        )
+    if sample.mode != 'RGB':
+        sample = sample.convert('RGB')
+    return sample.getcolors(maxcolors=SCREENSHOT_MAX_COLORS) is not None
+
+def choose_output_format(img, policy: Optional[ImagePolicy]) -> Tuple[str, bool]:
+    """
+    按编码策略和客户端可接受的格式选择输出格式
+
+    Returns:
+        (格式, 是否无损编码)
+    """
+    encoding = _encoding(policy)
+    accepted = _accepted_formats(policy)
+
+    if encoding == 'original':
+        source_format = (img.format or '').lower()
+        image_format, lossless = source_format, source_format != 'jpeg'
+    elif encoding == 'auto':
+        lossless = is_screenshot(img)
+        image_format = 'webp'
+    elif encoding == 'webp_lossless':
+        image_format, lossless = 'webp', True
+    else:
+        image_format, lossless = encoding, encoding == 'png'
+
+    if image_format in accepted and _format_supported(image_format):
+        return image_format, lossless
+    if lossless or 'jpeg' not in accepted:
+        return 'png', True
+    return 'jpeg', False
+
+def _lossy_format(policy: Optional[ImagePolicy]) -> str:
+    """超出字节预算时使用的有损格式"""
+    encoding = _encoding(policy)
+    accepted = _accepted_formats(policy)
+    if encoding == 'avif' and 'avif' in accepted and _format_supported('avif'):
+        return 'avif'
+    if encoding in ('auto', 'webp', 'webp_lossless') and 'webp' in accepted and _format_supported('webp'):
+        return 'webp'
+    return 'jpeg'
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """根据文件头魔数识别图片真实格式，无法识别时返回None"""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    if header[:2] == b'BM':
+        return 'bmp'
+    if header[4:8] == b'ftyp' and header[8:12] in (b'avif', b'avis'):
+        return 'avif'
+    return None
+
+def _validate_image_header(data: bytes, image_format: str) -> None:
+    """只解析图片头部（不解码像素）以确认文件未损坏且格式一致"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        if (img.format or '').lower() != image_format:
+            raise ValueError(f"文件头格式不一致: {img.format}")
+        width, height = img.size
+        if width <= 0 or height <= 0:
+            raise ValueError("图片尺寸无效")
+
+def _transcode_image(filename: str, data: bytes, policy: Optional[ImagePolicy] = None) -> ImageData:
+    """
+    解码并按编码策略重新编码图片
+
+    原始格式客户端可以接受、且重新编码后反而更大（或为动图）时保留原始字节。
+    """
+    try:
+        # PIL按需导入，避免拖慢界面启动
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data)) as img:
+            source_format = (img.format or '').lower()
+            keep_original = source_format in _accepted_formats(policy)
+            if keep_original and getattr(img, 'is_animated', False):
+                return ImageData(filename=filename, data=data, mime_type=f'image/{source_format}')
+
+            output_format, lossless = choose_output_format(img, policy)
+            if output_format == 'jpeg':
+                # JPEG不支持透明度，需要合成到白色背景
+                img = _flatten_to_rgb(img)
+            if output_format == source_format and _encoding(policy) == 'original':
+                # 保留原始尺寸和质量，只修复无法透传的文件
+                encoded = _encode_image(img, output_format)
+            else:
+                encoded = _encode_image(img, output_format, None if lossless else _quality(policy), lossless)
+    except Exception as e:
+        raise ImageProcessingError(f"处理图片 {filename} 时出错: {e}")
+
+    if keep_original and len(data) <= len(encoded):
+        return ImageData(filename=filename, data=data, mime_type=f'image/{source_format}')
+    return ImageData(
+        filename=filename,
+        data=encoded,
+        mime_type=f'image/{output_format}'
+    )
+
+def _encode_image(img, output_format: str, quality: Optional[int] = None, lossless: bool = False) -> bytes:
+    buffer = io.BytesIO()
+    if output_format == 'jpeg':
+        img.save(buffer, format='JPEG', quality=quality or 100)
+    elif output_format == 'webp':
+        if lossless:
+            img.save(buffer, format='WEBP', lossless=True, quality=WEBP_LOSSLESS_EFFORT)
+        else:
+            img.save(buffer, format='WEBP', quality=quality or 100)
+    elif output_format == 'avif':
+        img.save(buffer, format='AVIF', quality=quality or 100)
+    else:
+        img.save(buffer, format=output_format.upper(), optimize=True)
+    return buffer.getvalue()
+
+def _flatten_to_rgb(img):
+    """合成到白色背景上，用于转为不支持透明度的格式"""
+    from PIL import Image
+
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+def _encode_within_budget(img, output_format: str, max_bytes: int, lossy_format: str = 'jpeg'):
+    """
+    按质量阶梯编码图片，返回(字节, 格式)；无法满足预算时返回None
+
+    PNG等无损格式本身无法降低质量，超出预算时改用lossy_format有损压缩。
+    """
+    data = _encode_image(img, output_format)
+    if not max_bytes or len(data) <= max_bytes:
+        return data, output_format
+
+    if output_format not in ('jpeg', 'webp', 'avif'):
+        output_format = lossy_format
+        if output_format == 'jpeg':
+            img = _flatten_to_rgb(img)
+    for quality in QUALITY_STEPS:
+        data = _encode_image(img, output_format, quality)
+        if len(data) <= max_bytes:
+            return data, output_format
+    return None
+
+def apply_image_policy(image_data: ImageData, policy: Optional[ImagePolicy], max_bytes: int = 0) -> ImageData:
+    """
+    将图片缩放/重新压缩到预算以内，未超出预算时原样返回
+
+    Args:
+        image_data: 已处理的图片数据
+        policy: 负载预算，None表示不限制
+        max_bytes: 额外的字节上限（例如剩余总预算），0表示不限制
+
+    Raises:
+        ImageProcessingError: 无法压缩到预算以内
+    """
+    max_side = policy['max_side'] if policy else 0
+    limits = [limit for limit in (policy['max_image_bytes'] if policy else 0, max_bytes) if limit > 0]
+    byte_limit = min(limits) if limits else 0
+
+    if not max_side and (not byte_limit or len(image_data['data']) <= byte_limit):
+        return image_data
+
+    from PIL import Image
+
+    filename = image_data['filename']
+    try:
+        with Image.open(io.BytesIO(image_data['data'])) as img:
+            width, height = img.size
+            too_large = max_side and max(width, height) > max_side
+            if not too_large and (not byte_limit or len(image_data['data']) <= byte_limit):
+                return image_data
+
+            output_format = image_data['mime_type'].split('/')[-1]
+            if output_format not in ('jpeg', 'png', 'webp', 'avif'):
+                output_format = 'png'
+            img.load()
+            if output_format == 'jpeg':
+                img = _flatten_to_rgb(img)
+
+            if too_large:
+                img = img.copy()
+                img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+            for _ in range(MAX_DOWNSCALE_STEPS + 1):
+                encoded = _encode_within_budget(img, output_format, byte_limit, _lossy_format(policy))
+                if encoded is not None:
+                    data, output_format = encoded
+                    return ImageData(filename=filename, data=data, mime_type=f'image/{output_format}')
+                # 质量阶梯用尽仍超出预算，缩小尺寸后重试
+                new_size = (max(1, int(img.width * DOWNSCALE_FACTOR)), max(1, int(img.height * DOWNSCALE_FACTOR)))
+                img = img.resize(new_size, Image.Resampling.LANCZOS)
+    except Exception as e:
+        raise ImageProcessingError(f"压缩图片 {filename} 时出错: {e}")
+
+    raise ImageProcessingError(f"图片 {filename} 无法压缩到 {byte_limit} 字节以内")
+
+def apply_total_budget(image_data: ImageData, policy: Optional[ImagePolicy], used_bytes: int) -> ImageData:
+    """
+    按附加顺序扣减单次结果的总预算，超出剩余预算的图片继续压缩
+
+    Args:
+        image_data: 已处理的图片数据
+        policy: 负载预算，None表示不限制
+        used_bytes: 本次结果中已附加图片的总字节数
+
+    Raises:
+        ImageProcessingError: 总预算已用尽或无法压缩到剩余预算以内
+    """
+    max_total = policy['max_total_bytes'] if policy else 0
+    if not max_total:
+        return image_data
+    remaining = max_total - used_bytes
+    if remaining <= 0:
+        raise ImageProcessingError(f"图片 {image_data['filename']} 超出本次call dk的图片总大小限制")
+    result = apply_image_policy(image_data, policy, max_bytes=remaining)
+    if result is not image_data:
+        # 按剩余预算重新压缩的结果只属于本次call dk，不写入存储
+        result['sha256'] = image_sha256(result['data'])
+    return result
+
+def process_image_file(file_path: str, policy: Optional[ImagePolicy] = None) -> ImageData:
+    """
+    读取并编码单个图片文件
+
+    文件真实格式（按文件头识别）已是服务器可接受的格式时直接透传原始字节，
+    只校验文件头；否则解码后重新编码。超出负载预算的图片会被缩放和重新压缩。
+    处理结果写入图片存储，之后以相同预算再次处理同一文件时直接复用。
+
+    Args:
+        file_path: 图片文件路径
+        policy: 负载预算，None表示不限制
+
+    Returns:
+        处理后的图片数据
+
+    Raises:
+        ImageProcessingError: 文件过大或无法处理
+    """
+    filename = os.path.basename(file_path)
+
+    # 检查文件大小
+    file_size = os.path.getsize(file_path)
+    if file_size > MAX_IMAGE_FILE_SIZE:
+        raise ImageProcessingError(f"图片文件 {filename} 超过10MB限制。")
+
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    store = get_image_store()
+    source_key = None
+    if store is not None:
+        source_key = make_source_key(data, policy, PASSTHROUGH_ENABLED)
+        stored = store.get_by_source(source_key)
+        if stored is not None:
+            return ImageData(filename=filename, data=stored['data'],
+                             mime_type=stored['mime_type'], sha256=stored['sha256'])
+
+    image_data = _process_image_bytes(filename, data, policy)
+    if store is not None:
+        image_data['sha256'] = store.put(image_data['data'], image_data['mime_type'], source_key)
+    else:
+        image_data['sha256'] = image_sha256(image_data['data'])
+    return image_data
+
+def _process_image_bytes(filename: str, data: bytes, policy: Optional[ImagePolicy]) -> ImageData:
+    image_format = sniff_image_format(data[:16])
+    passthrough = PASSTHROUGH_ENABLED and _encoding(policy) == 'original'
+    if passthrough and image_format in _accepted_formats(policy):
+        try:
+            _validate_image_header(data, image_format)
+            image_data = ImageData(
+                filename=filename,
+                data=data,
+                mime_type=f'image/{image_format}'
+            )
+            return apply_image_policy(image_data, policy)
+        except ImageProcessingError:
+            raise
+        except Exception:
+            # 文件头校验失败时交给完整解码流程，由其给出具体错误
+            pass
+
+    return apply_image_policy(_transcode_image(filename, data, policy), policy)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+图片内容寻址存储模块
+以处理后图片字节的sha256为键保存图片、MIME类型、尺寸和缩略图，
+界面进程和服务器共用同一个SQLite文件，按总大小淘汰最久未使用的图片
+"""
+
+import io
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, Tuple, TypedDict
+
+from sqlite_file import SQLiteFile
+
+# 缩略图尺寸（界面预览和资源元数据共用）
+THUMBNAIL_SIZE = (100, 70)
+THUMBNAIL_QUALITY = 75
+
+class StoredImage(TypedDict):
+    sha256: str
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+
+class ImageInfo(TypedDict):
+    mime_type: str
+    width: int
+    height: int
+    size: int
+    thumbnail: Optional[bytes]  # JPEG缩略图，生成失败时为None
+
+def image_sha256(data: bytes) -> str:
+    """图片字节的内容哈希"""
+    return hashlib.sha256(data).hexdigest()
+
+def make_source_key(source_data: bytes, *parts) -> str:
+    """
+    根据原始文件内容和影响处理结果的参数（负载预算、透传开关等）生成来源键，
+    同一文件在相同参数下处理结果相同，可直接复用
+    """
+    digest = hashlib.sha256(source_data)
+    digest.update(json.dumps(parts, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def make_thumbnail(data: bytes) -> Tuple[bytes, int, int]:
+    """生成JPEG缩略图，返回(缩略图字节, 原图宽, 原图高)；界面预览和资源元数据共用"""
+    from PIL import Image
+    # image_processing在导入时依赖本模块，在此按需导入
+    from image_processing import _flatten_to_rgb
+
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        # JPEG可直接按缩小的尺寸解码，大幅减少解码开销
+        img.draft('RGB', (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+        img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        _flatten_to_rgb(img).save(buffer, format='JPEG', quality=THUMBNAIL_QUALITY)
+    return buffer.getvalue(), width, height
+
+class ImageStore:
+    """
+    图片内容寻址存储
+
+    images表以内容哈希保存处理后的图片，sources表记录"原始文件+处理参数 -> 内容哈希"，
+    再次附加同一文件时跳过解码和重新编码。每次操作使用独立的SQLite连接（WAL模式），
+    可在图片处理线程池和多个进程中并发使用；存储不可用时所有操作静默失败。
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._db = SQLiteFile(path, [
+            "CREATE TABLE IF NOT EXISTS images ("
+            "sha256 TEXT PRIMARY KEY, mime_type TEXT NOT NULL, data BLOB NOT NULL, "
+            "thumbnail BLOB, width INTEGER NOT NULL, height INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, accessed REAL NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS sources (source_key TEXT PRIMARY KEY, sha256 TEXT NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed)",
+        ])
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._db.connect()
+
+    def _query(self, sql: str, params: tuple, touch: Optional[str] = None):
+        """执行查询并返回第一行，touch为命中图片的哈希时更新其访问时间"""
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(sql, params).fetchone()
+                if row is not None and touch is not None:
+                    conn.execute("UPDATE images SET accessed = ? WHERE sha256 = ?", (time.time(), row[touch]))
+                    conn.commit()
+                return row
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            return None
+
+    def get(self, sha256: str) -> Optional[StoredImage]:
+        """按内容哈希读取图片，未命中时返回None"""
+        row = self._query(
+            "SELECT sha256, data, mime_type, width, height FROM images WHERE sha256 = ?", (sha256,), touch=0
+        )
+        if row is None:
+            return None
+        return StoredImage(sha256=row[0], data=row[1], mime_type=row[2], width=row[3], height=row[4])
+
+    def get_by_source(self, source_key: str) -> Optional[StoredImage]:
+        """按来源键读取已处理过的图片"""
+        row = self._query(
+            "SELECT images.sha256, data, mime_type, width, height FROM sources "
+            "JOIN images ON images.sha256 = sources.sha256 WHERE source_key = ?",
+            (source_key,), touch=0
+        )
+        if row is None:
+            return None
+        return StoredImage(sha256=row[0], data=row[1], mime_type=row[2], width=row[3], height=row[4])
+
+    def get_thumbnail(self, sha256: str) -> Optional[bytes]:
+        row = self._query("SELECT thumbnail FROM images WHERE sha256 = ?", (sha256,))
+        return row[0] if row is not None else None
+
+    def get_info(self, sha256: str) -> Optional[ImageInfo]:
+        """读取图片的尺寸、大小和缩略图，不读取图片本身"""
+        row = self._query(
+            "SELECT mime_type, width, height, size, thumbnail FROM images WHERE sha256 = ?", (sha256,)
+        )
+        if row is None:
+            return None
+        return ImageInfo(mime_type=row[0], width=row[1], height=row[2], size=row[3], thumbnail=row[4])
+
+    def put(self, data: bytes, mime_type: str, source_key: Optional[str] = None) -> str:
+        """
+        保存图片并生成缩略图，返回内容哈希；已存在的图片只更新访问时间
+
+        超出总大小上限时淘汰最久未访问的图片，刚写入的图片不会被淘汰；
+        单张超过总大小上限的图片不保存。
+        """
+        sha256 = image_sha256(data)
+        if self.max_bytes > 0 and len(data) > self.max_bytes:
+            return sha256
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                exists = conn.execute("SELECT 1 FROM images WHERE sha256 = ?", (sha256,)).fetchone()
+                if exists:
+                    conn.execute("UPDATE images SET accessed = ? WHERE sha256 = ?", (now, sha256))
+                else:
+                    try:
+                        thumbnail, width, height = make_thumbnail(data)
+                    except Exception:
+                        thumbnail, width, height = None, 0, 0
+                    conn.execute(
+                        "INSERT OR REPLACE INTO images (sha256, mime_type, data, thumbnail, width, height, size, accessed) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (sha256, mime_type, data, thumbnail, width, height, len(data), now)
+                    )
+                if source_key:
+                    conn.execute("INSERT OR REPLACE INTO sources (source_key, sha256) VALUES (?, ?)", (source_key, sha256))
+                conn.commit()
+                if not exists:
+                    self._evict(conn, keep=sha256)
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            pass
+        return sha256
+
+    def _evict(self, conn: sqlite3.Connection, keep: str):
+        if self.max_bytes <= 0:
+            return
+        # 同一进程内的多个处理线程不必同时执行淘汰
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute(
+                "SELECT sha256, size FROM images WHERE sha256 != ? ORDER BY accessed", (keep,)
+            ).fetchall()
+            for sha256, size in rows:
+                conn.execute("DELETE FROM images WHERE sha256 = ?", (sha256,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            conn.execute("DELETE FROM sources WHERE sha256 NOT IN (SELECT sha256 FROM images)")
+            conn.commit()
+        finally:
+            self._lock.release()
+
+_image_store = None
+_image_store_loaded = False
+
+def get_image_store() -> Optional[ImageStore]:
+    """获取共享的图片存储实例，未启用时返回None"""
+    global _image_store, _image_store_loaded
+    if not _image_store_loaded:
+        _image_store_loaded = True
+        if os.getenv('CALLDK_IMAGE_STORE_ENABLED', 'true').lower() == 'true':
+            _image_store = ImageStore(
+                os.path.expanduser(os.getenv(
+                    'CALLDK_IMAGE_STORE_PATH',
+                    os.path.join(os.path.expanduser('~'), '.calldk', 'image_store.sqlite3')
+                )),
+                max_bytes=int(os.getenv('CALLDK_IMAGE_STORE_MAX_BYTES', str(256 * 1024 * 1024)))
+            )
+    return _image_store
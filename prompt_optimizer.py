@@ -5,16 +5,261 @@
 """
 
 import os
-from typing import Optional
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, TypedDict
 from dotenv import load_dotenv
 
+from sqlite_file import SQLiteFile
+
 try:
     from google import genai
     from google.genai import types
+    from google.genai import errors
     GENAI_AVAILABLE = True
 except ImportError:
     GENAI_AVAILABLE = False
 
+# 可重试的API错误码：限流与服务暂时不可用
+RETRYABLE_STATUS_CODES = (429, 503)
+
+class BatchResult(TypedDict):
+    index: int  # 在输入中的序号
+    input: str
+    output: Optional[str]  # 优化结果，失败时为None
+    error: Optional[str]  # 错误消息，成功时为None
+
+def is_retryable_error(error: Exception) -> bool:
+    """判断错误是否为限流等可重试的错误"""
+    if GENAI_AVAILABLE and isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return False
+
+class OptimizationCache:
+    """
+    提示词优化结果缓存
+
+    内存LRU在前，磁盘SQLite在后；SQLite负责多个界面进程之间的并发访问，
+    按最近访问时间淘汰超出数量上限的条目，超过TTL的条目视为失效。
+    """
+
+    def __init__(self, path: str, max_entries: int = 500, ttl_seconds: int = 7 * 24 * 3600, memory_entries: int = 64):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # 键 -> (结果, 写入时间)
+        self._lock = threading.Lock()
+        self._db = SQLiteFile(path, [
+            "CREATE TABLE IF NOT EXISTS optimize_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        ])
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """根据影响优化结果的全部参数生成缓存键"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每次操作使用独立连接，避免跨线程共享连接
+        return self._db.connect()
+
+    def _is_expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._is_expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    return entry[0]
+                del self._memory[key]
+
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT value, created FROM optimize_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                value, created = row
+                if self._is_expired(created, now):
+                    conn.execute("DELETE FROM optimize_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                conn.execute("UPDATE optimize_cache SET accessed = ? WHERE key = ?", (now, key))
+                conn.commit()
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            # 磁盘缓存不可用时不影响优化功能
+            return None
+
+        self._remember(key, value, created)
+        return value
+
+    def put(self, key: str, value: str):
+        """写入缓存并按数量上限淘汰最久未访问的条目"""
+        now = time.time()
+        self._remember(key, value, now)
+
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO optimize_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                if self.ttl_seconds > 0:
+                    conn.execute("DELETE FROM optimize_cache WHERE created < ?", (now - self.ttl_seconds,))
+                conn.execute(
+                    "DELETE FROM optimize_cache WHERE key IN ("
+                    "SELECT key FROM optimize_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            pass
+
+    def _remember(self, key: str, value: str, created: float):
+        with self._lock:
+            self._memory[key] = (value, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+class Route(TypedDict):
+    name: str
+    model: str
+    max_input_chars: int  # 适用的输入长度上限（字符），0表示不限制
+    thinking_budget: int
+    max_tokens: int
+
+# 观测延迟的指数加权移动平均系数，越大越偏向最近的观测
+LATENCY_EWMA_ALPHA = 0.3
+
+# 因延迟超出目标而被连续跳过此次数后，重新选择一次该路由以刷新其延迟估计
+ROUTE_PROBE_INTERVAL = 20
+
+# 每个路由保留的最近响应耗时样本数，以及按百分位计算对冲延迟所需的最少样本数
+ROUTE_LATENCY_SAMPLES = 50
+MIN_HEDGE_SAMPLES = 10
+
+class ModelRouter:
+    """
+    按输入长度和延迟目标为每次优化选择模型、思考预算和输出上限
+
+    路由按配置顺序排列，选择第一个能容纳输入长度、且观测延迟（EWMA）不超过延迟目标的路由；
+    都超出目标时选择能容纳输入的路由中观测延迟最低的一个。尚无观测数据的路由视为满足目标。
+    """
+
+    def __init__(self, routes: List[Route], latency_target_ms: float = 0):
+        if not routes:
+            raise ValueError("至少需要配置一个路由")
+        self.routes = routes
+        self.latency_target_ms = latency_target_ms
+        self._latency_ms: Dict[str, float] = {}  # 路由名 -> 观测延迟EWMA（毫秒）
+        self._response_samples: Dict[str, deque] = {}  # 路由名 -> 最近的响应耗时（毫秒）
+        self._skipped: Dict[str, int] = {}  # 路由名 -> 连续被跳过的次数
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls, default_route: Route) -> "ModelRouter":
+        """
+        从GEMINI_ROUTES（JSON数组）读取路由，未配置时只使用default_route
+
+        每个路由可省略model、thinking_budget和max_tokens，省略的字段取default_route的值。
+        """
+        raw_routes = os.getenv('GEMINI_ROUTES', '').strip()
+        routes = []
+        if raw_routes:
+            try:
+                for index, entry in enumerate(json.loads(raw_routes)):
+                    routes.append(Route(
+                        name=str(entry.get('name', f"route{index}")),
+                        model=entry.get('model', default_route['model']),
+                        max_input_chars=int(entry.get('max_input_chars', 0)),
+                        thinking_budget=int(entry.get('thinking_budget', default_route['thinking_budget'])),
+                        max_tokens=int(entry.get('max_tokens', default_route['max_tokens']))
+                    ))
+            except (ValueError, TypeError, AttributeError) as e:
+                # 路由配置有误时不影响优化功能，退回默认路由
+                print(f"GEMINI_ROUTES配置无效，使用默认模型: {e}", file=sys.stderr)
+                routes = []
+        return cls(routes or [default_route], float(os.getenv('GEMINI_LATENCY_TARGET_MS', '0')))
+
+    def _fits(self, route: Route, input_chars: int) -> bool:
+        return not route['max_input_chars'] or input_chars <= route['max_input_chars']
+
+    def select(self, original_prompt: str) -> Route:
+        input_chars = len(original_prompt.strip())
+        candidates = [route for route in self.routes if self._fits(route, input_chars)]
+        if not candidates:
+            # 输入超出所有路由的长度上限时使用上限最大的路由
+            return max(self.routes, key=lambda route: route['max_input_chars'])
+
+        with self._lock:
+            if self.latency_target_ms <= 0:
+                return candidates[0]
+            for route in candidates:
+                latency = self._latency_ms.get(route['name'])
+                if latency is None or latency <= self.latency_target_ms:
+                    return route
+                # 超出目标的路由定期重新尝试，避免一次慢请求使其永久不被选择
+                skipped = self._skipped.get(route['name'], 0) + 1
+                if skipped >= ROUTE_PROBE_INTERVAL:
+                    self._skipped[route['name']] = 0
+                    return route
+                self._skipped[route['name']] = skipped
+            return min(candidates, key=lambda route: self._latency_ms[route['name']])
+
+    def record(self, route: Route, latency_ms: float, response_ms: Optional[float] = None):
+        """
+        记录一次请求的耗时
+
+        Args:
+            latency_ms: 完成耗时，用于路由选择
+            response_ms: 开始响应的耗时（流式请求为收到第一段文本），用于对冲延迟；None表示与完成耗时相同
+        """
+        with self._lock:
+            previous = self._latency_ms.get(route['name'])
+            self._latency_ms[route['name']] = latency_ms if previous is None else (
+                LATENCY_EWMA_ALPHA * latency_ms + (1 - LATENCY_EWMA_ALPHA) * previous
+            )
+            self._skipped[route['name']] = 0
+            samples = self._response_samples.setdefault(route['name'], deque(maxlen=ROUTE_LATENCY_SAMPLES))
+            samples.append(latency_ms if response_ms is None else response_ms)
+
+    def response_percentile_ms(self, route: Route, percentile: float) -> Optional[float]:
+        """路由最近响应耗时的百分位数，样本不足时返回None"""
+        with self._lock:
+            samples = sorted(self._response_samples.get(route['name'], ()))
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def latency_estimates(self) -> Dict[str, float]:
+        """各路由当前的观测延迟（毫秒）"""
+        with self._lock:
+            return {name: round(latency, 1) for name, latency in self._latency_ms.items()}
+
 class PromptOptimizer:
     """提示词优化器类"""
     
@@ -31,10 +276,42 @@ class PromptOptimizer:
         self.max_tokens = int(os.getenv('GEMINI_MAX_TOKENS', '1000'))
         self.thinking_budget = int(os.getenv('GEMINI_THINKING_BUDGET', '512'))
         self.include_thoughts = os.getenv('GEMINI_INCLUDE_THOUGHTS', 'false').lower() == 'true'
+        self.stream = os.getenv('GEMINI_STREAM', 'true').lower() == 'true'
+        self.speculative = os.getenv('GEMINI_SPECULATIVE', 'false').lower() == 'true'
+        self.speculative_delay_ms = int(os.getenv('GEMINI_SPECULATIVE_DELAY_MS', '1200'))
+        self.timeout = float(os.getenv('GEMINI_TIMEOUT', '60'))  # 异步接口的超时（秒）
+        self.prewarm = os.getenv('GEMINI_PREWARM', 'true').lower() == 'true'
+        self.max_retries = int(os.getenv('GEMINI_MAX_RETRIES', '5'))
+        self.retry_base_delay = float(os.getenv('GEMINI_RETRY_BASE_DELAY', '1.0'))
+        self.batch_concurrency = int(os.getenv('GEMINI_BATCH_CONCURRENCY', '4'))
+        self.keepalive_interval = float(os.getenv('GEMINI_KEEPALIVE_INTERVAL', '0'))  # 保活间隔（秒），0表示不保活
+        # 对冲请求：首个请求超过对冲延迟仍未响应时再发一个请求，采用先返回的结果
+        self.hedge = os.getenv('GEMINI_HEDGE_ENABLED', 'false').lower() == 'true'
+        self.hedge_percentile = float(os.getenv('GEMINI_HEDGE_PERCENTILE', '95'))
+        self.hedge_delay_ms = float(os.getenv('GEMINI_HEDGE_DELAY_MS', '2000'))  # 样本不足时使用的对冲延迟
+        # 出错时依次改用的备用模型
+        self.fallback_models = [
+            model.strip() for model in os.getenv('GEMINI_FALLBACK_MODELS', '').split(',') if model.strip()
+        ]
         self.system_instruction = os.getenv('GEMINI_SYSTEM_INSTRUCTION', 
             '你是提示词优化专家。将用户的简单提示词优化为更清晰、具体、有效的提示词。'
             '优化原则：1. 保持原始意图不变 2. 增加必要的细节和描述 3. 使语言更准确和逻辑性强 '
             '4. 输出简洁明了 5. 适用于各种领域和场景。直接输出优化后的提示词，不要添加额外说明。')
+
+        # 按输入长度和延迟目标选择模型的路由，未配置GEMINI_ROUTES时只有默认路由
+        self.router = ModelRouter.from_environment(Route(
+            name='default', model=self.model_name, max_input_chars=0,
+            thinking_budget=self.thinking_budget, max_tokens=self.max_tokens
+        ))
+
+        # 优化结果缓存
+        self.cache = None
+        if os.getenv('GEMINI_CACHE_ENABLED', 'true').lower() == 'true':
+            self.cache = OptimizationCache(
+                os.getenv('GEMINI_CACHE_PATH', os.path.join(os.path.expanduser('~'), '.calldk', 'optimize_cache.sqlite3')),
+                max_entries=int(os.getenv('GEMINI_CACHE_MAX_ENTRIES', '500')),
+                ttl_seconds=int(os.getenv('GEMINI_CACHE_TTL', str(7 * 24 * 3600)))
+            )
         
         self.client = None
         self._initialize_client()
@@ -81,33 +358,317 @@ class PromptOptimizer:
         Raises:
             Exception: 优化过程中的错误
         """
+        self._check_request(original_prompt)
+
+        route = self.router.select(original_prompt)
+        cached = self.cache.get(self._cache_key(original_prompt, route)) if self.cache else None
+        if cached is not None:
+            return cached
+
+        # 调用API进行优化，出错时依次改用备用模型
+        error = None
+        for attempt_route in self._route_chain(route):
+            try:
+                start = time.perf_counter()
+                response = self.client.models.generate_content(
+                    model=attempt_route['model'],
+                    contents=self._build_contents(original_prompt),
+                    config=self._build_generation_config(attempt_route)
+                )
+                self.router.record(attempt_route, (time.perf_counter() - start) * 1000)
+                break
+            except Exception as e:
+                error = e
+        else:
+            raise error
+
+        result = response.text.strip() if response and response.text else ""
+        # 按实际回答的模型缓存，备用模型的结果不会作为主模型的结果返回
+        self._store_result(self._cache_key(original_prompt, attempt_route), result)
+        return result
+
+    def optimize_prompt_with_retry(self, original_prompt: str, max_retries: Optional[int] = None) -> str:
+        """
+        优化提示词，遇到限流等可重试错误时指数退避重试
+
+        Args:
+            original_prompt: 原始提示词
+            max_retries: 最大重试次数，None表示使用GEMINI_MAX_RETRIES
+
+        Returns:
+            优化后的提示词
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        attempt = 0
+        while True:
+            try:
+                return self.optimize_prompt(original_prompt)
+            except Exception as e:
+                if attempt >= max_retries or not is_retryable_error(e):
+                    raise
+                # 指数退避并加入随机抖动，避免并发请求同时重试
+                delay = self.retry_base_delay * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+
+    async def warm_up_async(self) -> float:
+        """
+        预热到Gemini API的连接
+
+        通过一次轻量的模型元数据查询完成DNS解析、TCP/TLS握手和SDK的惰性初始化，
+        使之后的第一次优化请求可以复用已建立的连接。
+
+        Returns:
+            预热耗时（秒）
+        """
+        if not self.is_available():
+            raise RuntimeError(self.get_status_message())
+
+        start = time.perf_counter()
+        await asyncio.wait_for(self.client.aio.models.get(model=self.model_name), timeout=self.timeout)
+        return time.perf_counter() - start
+
+    async def optimize_prompt_async(self, original_prompt: str, timeout: Optional[float] = None) -> str:
+        """
+        异步优化提示词，可被取消
+
+        Args:
+            original_prompt: 原始提示词
+            timeout: 超时时间（秒），None表示使用GEMINI_TIMEOUT
+
+        Returns:
+            优化后的提示词
+
+        Raises:
+            asyncio.TimeoutError: 超时
+            Exception: 优化过程中的错误
+        """
+        self._check_request(original_prompt)
+
+        route = self.router.select(original_prompt)
+        cached = self.cache.get(self._cache_key(original_prompt, route)) if self.cache else None
+        if cached is not None:
+            return cached
+
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            result, answered_route = await self._request_with_fallback(
+                lambda attempt_route: self._generate_async(original_prompt, attempt_route),
+                route, time.monotonic() + timeout
+            )
+        except asyncio.TimeoutError:
+            # 超时计为一次耗时为超时时间的观测，使慢路由的延迟估计上升
+            self.router.record(route, timeout * 1000)
+            raise
+
+        self._store_result(self._cache_key(original_prompt, answered_route), result)
+        return result
+
+    async def optimize_prompt_stream_async(self, original_prompt: str) -> AsyncIterator[str]:
+        """
+        异步流式优化提示词，按到达顺序逐段产出文本
+
+        超时由调用方控制；取消正在迭代的任务会中断底层请求。
+
+        Args:
+            original_prompt: 原始提示词
+
+        Yields:
+            优化结果的文本片段（开头的空白已去除）
+        """
+        self._check_request(original_prompt)
+
+        route = self.router.select(original_prompt)
+        cached = self.cache.get(self._cache_key(original_prompt, route)) if self.cache else None
+        if cached is not None:
+            yield cached
+            return
+
+        # 对冲和备用模型只作用于收到第一段文本之前，之后沿用胜出的流
+        (stream, first_text, start, response_ms), answered_route = await self._request_with_fallback(
+            lambda attempt_route: self._open_stream_async(original_prompt, attempt_route),
+            route, time.monotonic() + self.timeout,
+            discard=lambda opened: self._close_stream(opened[0])
+        )
+
+        parts = []
+        try:
+            if first_text:
+                parts.append(first_text)
+                yield first_text
+            async for chunk in stream:
+                text = chunk.text if chunk else None
+                if not text:
+                    continue
+                if not parts:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                parts.append(text)
+                yield text
+        finally:
+            # 调用方提前停止迭代或任务被取消时也关闭底层的HTTP响应
+            await self._close_stream(stream)
+
+        self.router.record(answered_route, (time.perf_counter() - start) * 1000, response_ms)
+        self._store_result(self._cache_key(original_prompt, answered_route), "".join(parts).strip())
+
+    async def _generate_async(self, original_prompt: str, route: Route) -> str:
+        start = time.perf_counter()
+        response = await self.client.aio.models.generate_content(
+            model=route['model'],
+            contents=self._build_contents(original_prompt),
+            config=self._build_generation_config(route)
+        )
+        self.router.record(route, (time.perf_counter() - start) * 1000)
+        return response.text.strip() if response and response.text else ""
+
+    async def _open_stream_async(self, original_prompt: str, route: Route):
+        """打开流式请求并读到第一段非空文本，返回(流, 第一段文本, 开始时间, 开始响应耗时)"""
+        start = time.perf_counter()
+        stream = await self.client.aio.models.generate_content_stream(
+            model=route['model'],
+            contents=self._build_contents(original_prompt),
+            config=self._build_generation_config(route)
+        )
+        first_text = ""
+        try:
+            async for chunk in stream:
+                text = chunk.text.lstrip() if chunk and chunk.text else ""
+                if text:
+                    first_text = text
+                    break
+        except BaseException:
+            # 出错或作为对冲的落后请求被取消时关闭已打开的流
+            await self._close_stream(stream)
+            raise
+        return stream, first_text, start, (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    async def _close_stream(stream):
+        aclose = getattr(stream, 'aclose', None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                pass
+
+    def _route_chain(self, route: Route) -> List[Route]:
+        """选中的路由及按GEMINI_FALLBACK_MODELS依次替换模型的备用路由"""
+        chain = [route]
+        for model in self.fallback_models:
+            if model != route['model']:
+                chain.append(Route(**{**route, 'name': f"{route['name']}:{model}", 'model': model}))
+        return chain
+
+    async def _request_with_fallback(self, request, route: Route, deadline: float, discard=None):
+        """
+        按备用模型链依次请求，出错时改用下一个模型，全部失败时抛出最后一个错误
+
+        每一级都可以对冲：请求超过对冲延迟仍未返回时，向链中的下一个模型（没有时为同一模型）
+        再发一个请求，采用先成功返回的结果并取消另一个。
+
+        Args:
+            request: 接收路由、返回请求协程的函数
+            deadline: 整体截止时间（time.monotonic()），超过时抛出asyncio.TimeoutError
+            discard: 释放未被采用的成功结果的协程函数（如关闭已打开的流）
+
+        Returns:
+            (结果, 实际返回结果的路由)，缓存按实际返回结果的路由区分
+        """
+        chain = self._route_chain(route)
+        error = None
+        for index, attempt_route in enumerate(chain):
+            if time.monotonic() >= deadline:
+                break
+            hedge_route = chain[index + 1] if index + 1 < len(chain) else attempt_route
+            try:
+                return await self._hedged_request(request, attempt_route, hedge_route, deadline, discard)
+            except asyncio.TimeoutError:
+                raise
+            except Exception as e:
+                error = e
+        if error is None:
+            raise asyncio.TimeoutError()
+        raise error
+
+    def _hedge_delay(self, route: Route) -> float:
+        """对冲延迟（秒）：路由响应耗时的GEMINI_HEDGE_PERCENTILE百分位，样本不足时为GEMINI_HEDGE_DELAY_MS"""
+        delay_ms = self.router.response_percentile_ms(route, self.hedge_percentile)
+        return (self.hedge_delay_ms if delay_ms is None else delay_ms) / 1000
+
+    async def _hedged_request(self, request, route: Route, hedge_route: Route, deadline: float, discard=None):
+        routes = {asyncio.ensure_future(request(route)): route}  # 请求任务 -> 路由
+        winner = None
+        try:
+            if self.hedge:
+                done, _ = await asyncio.wait(
+                    set(routes), timeout=min(self._hedge_delay(route), max(deadline - time.monotonic(), 0))
+                )
+                if not done and time.monotonic() < deadline:
+                    routes[asyncio.ensure_future(request(hedge_route))] = hedge_route
+
+            error = None
+            pending = set(routes)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(deadline - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        return task.result(), routes[task]
+                    error = task.exception()
+            raise error
+        finally:
+            # 取消落后的请求并等待其结束，已成功但未被采用的结果（如同时完成的另一个流）交给discard释放
+            losers = [task for task in routes if task is not winner]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+            if discard is not None:
+                for task in losers:
+                    if not task.cancelled() and task.exception() is None:
+                        await discard(task.result())
+
+    def _cache_key(self, original_prompt: str, route: Route) -> str:
+        return OptimizationCache.make_key(
+            original_prompt.strip(), route['model'], self.system_instruction,
+            self.temperature, self.top_p, route['max_tokens'], route['thinking_budget']
+        )
+
+    def _store_result(self, cache_key: str, result: str):
+        # 空结果通常意味着输出被截断或异常，不缓存
+        if self.cache and result:
+            self.cache.put(cache_key, result)
+
+    def _check_request(self, original_prompt: str):
         if not original_prompt or not original_prompt.strip():
             raise ValueError("输入的提示词不能为空")
-        
+
         if not self.is_available():
             raise RuntimeError(self.get_status_message())
-        
-        # 创建生成配置
-        generation_config = types.GenerateContentConfig(
+
+    def _build_contents(self, original_prompt: str) -> str:
+        return f"请优化这个提示词：{original_prompt.strip()}"
+
+    def _build_generation_config(self, route: Route):
+        """按路由创建生成配置"""
+        return types.GenerateContentConfig(
             system_instruction=self.system_instruction,
             temperature=self.temperature,
             top_p=self.top_p,
-            max_output_tokens=self.max_tokens,
+            max_output_tokens=route['max_tokens'],
             thinking_config={
-                "thinking_budget": self.thinking_budget,
+                "thinking_budget": route['thinking_budget'],
                 "include_thoughts": self.include_thoughts
             }
         )
 
-        # 调用API进行优化
-        response = self.client.models.generate_content(
-            model=self.model_name,
-            contents=f"请优化这个提示词：{original_prompt.strip()}",
-            config=generation_config
-        )
-
-        return response.text.strip() if response and response.text else ""
-
 # 全局优化器实例
 _optimizer_instance = None
 
@@ -131,6 +692,86 @@ def optimize_prompt(text: str) -> str:
     optimizer = get_optimizer()
     return optimizer.optimize_prompt(text)
 
+def optimize_prompts(prompts: Iterable[str], concurrency: Optional[int] = None,
+                     max_retries: Optional[int] = None) -> Iterator[BatchResult]:
+    """
+    批量优化提示词
+
+    以有限并发执行请求，限流时自动退避重试，并按输入顺序逐个产出结果：
+    前面的请求一完成就立即产出，不必等待整批结束。单个提示词失败不会中断整批。
+
+    Args:
+        prompts: 要优化的提示词序列，可以是惰性迭代器
+        concurrency: 最大并发请求数，None表示使用GEMINI_BATCH_CONCURRENCY
+        max_retries: 单个请求的最大重试次数，None表示使用GEMINI_MAX_RETRIES
+
+    Yields:
+        按输入顺序排列的优化结果
+    """
+    optimizer = get_optimizer()
+    concurrency = max(1, concurrency or optimizer.batch_concurrency)
+    # 限制已提交但尚未产出的请求数，避免前面的慢请求导致结果无限堆积
+    max_pending = concurrency * 4
+
+    def collect(entry) -> BatchResult:
+        index, text, future = entry
+        try:
+            return BatchResult(index=index, input=text, output=future.result(), error=None)
+        except Exception as e:
+            return BatchResult(index=index, input=text, output=None, error=str(e) or e.__class__.__name__)
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, text in enumerate(prompts):
+            pending.append((index, text, executor.submit(optimizer.optimize_prompt_with_retry, text, max_retries)))
+            while pending and (pending[0][2].done() or len(pending) >= max_pending):
+                yield collect(pending.popleft())
+        while pending:
+            yield collect(pending.popleft())
+
+def _read_batch_prompts(stream) -> Iterator[dict]:
+    """读取JSONL输入：每行是JSON字符串，或包含prompt字段的对象"""
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"第{line_number}行不是合法的JSON: {e}")
+        if isinstance(record, str):
+            record = {"prompt": record}
+        if not isinstance(record, dict) or not isinstance(record.get("prompt"), str):
+            raise ValueError(f"第{line_number}行缺少字符串类型的prompt字段")
+        yield record
+
+def run_batch(input_stream, output_stream, concurrency: Optional[int] = None) -> int:
+    """
+    批量优化JSONL输入，逐行输出原记录附加optimized或error字段
+
+    Returns:
+        失败的条目数
+    """
+    records = []
+
+    def prompts():
+        for record in _read_batch_prompts(input_stream):
+            records.append(record)
+            yield record["prompt"]
+
+    failures = 0
+    for result in optimize_prompts(prompts(), concurrency=concurrency):
+        record = records[result["index"]]
+        records[result["index"]] = None  # 已输出的记录不再保留
+        if result["error"] is None:
+            record["optimized"] = result["output"]
+        else:
+            record["error"] = result["error"]
+            failures += 1
+        output_stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output_stream.flush()
+    return failures
+
 def is_optimizer_available() -> bool:
     """检查优化器是否可用"""
     optimizer = get_optimizer()
@@ -141,7 +782,40 @@ def get_optimizer_status() -> str:
     optimizer = get_optimizer()
     return optimizer.get_status_message()
 
+def _run_batch_cli(args) -> int:
+    optimizer = get_optimizer()
+    if not optimizer.is_available():
+        print(optimizer.get_status_message(), file=sys.stderr)
+        return 2
+
+    input_stream = sys.stdin if args.batch == "-" else open(args.batch, "r", encoding="utf-8")
+    output_stream = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        failures = run_batch(input_stream, output_stream, args.concurrency)
+    except ValueError as e:
+        print(f"输入错误: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output_stream is not sys.stdout:
+            output_stream.close()
+
+    if failures:
+        print(f"{failures} 条提示词优化失败", file=sys.stderr)
+        return 1
+    return 0
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="提示词优化")
+    parser.add_argument("--batch", metavar="FILE", help="批量优化JSONL文件中的提示词，'-'表示从stdin读取")
+    parser.add_argument("--output", default="-", metavar="FILE", help="批量结果输出的JSONL文件，默认输出到stdout")
+    parser.add_argument("--concurrency", type=int, help="最大并发请求数，默认使用GEMINI_BATCH_CONCURRENCY")
+    args = parser.parse_args()
+
+    if args.batch:
+        sys.exit(_run_batch_cli(args))
+
     # 测试代码
     optimizer = PromptOptimizer()
     print(f"优化器状态: {optimizer.get_status_message()}")
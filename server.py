@@ -1,63 +1,598 @@
 # dk call mcp
 import os
 import sys
-import json
-import tempfile
+import time
+import queue
+import atexit
+import base64
+import argparse
+import threading
 import subprocess
 
-from typing import List, Union
-import base64
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
-from fastmcp import FastMCP
+import anyio
+
+from fastmcp import Context, FastMCP
+from fastmcp.exceptions import ResourceError, ToolError
 from fastmcp.utilities.types import Image
+from mcp.types import ContentBlock, ImageContent, ResourceLink, TextContent
+
+# 本地模块在导入时读取部分配置（如CALLDK_IMAGE_PASSTHROUGH），必须先加载.env
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+from calldk_ipc import read_frame, write_frame, FrameError
+from calldk_metrics import CallMetrics, MetricsRecorder
+from calldk_tty import tty_calldk
+from image_processing import ImagePolicy, load_image_policy, sniff_image_format
+from image_store import get_image_store, image_sha256, make_thumbnail
 
 # log_level 对于 Cline 的正常工作是必需的：https://github.com/jlowin/fastmcp/issues/81
 mcp = FastMCP("dk call mcp", log_level="ERROR")
 
-def launch_calldk_ui(project_directory: str, summary: str) -> List[Union[str, Image]]:
-    # 为call dk结果创建临时文件
-    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
-        output_file = tmp.name
+# 获取相对于此脚本的 calldk_ui.py 路径
+CALLDK_UI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calldk_ui.py")
+
+# 是否使用常驻界面宿主进程（设置为false时每次调用都冷启动界面进程）
+USE_UI_HOST = os.getenv("CALLDK_UI_HOST", "true").lower() == "true"
+
+# 图片字节的传输方式：pipe（帧负载）或 shm（共享内存 + 清单）
+IMAGE_TRANSPORT = os.getenv("CALLDK_IMAGE_TRANSPORT", "pipe").lower()
+
+# 响应后端：qt（图形界面）、tty（控制终端，不依赖Qt）、auto（没有图形显示环境时使用tty）
+BACKEND = os.getenv("CALLDK_BACKEND", "qt").lower()
+BACKENDS = ("qt", "tty", "auto")
+
+# MCP传输方式：stdio（每个客户端启动独立的服务器进程）或 http（一个服务器服务多个客户端）
+TRANSPORT = os.getenv("CALLDK_TRANSPORT", "stdio").lower()
+HTTP_HOST = os.getenv("CALLDK_HTTP_HOST", "127.0.0.1")
+HTTP_PORT = int(os.getenv("CALLDK_HTTP_PORT", "8765"))
+
+# 背压限制（0表示不限制）：所有客户端等待中的请求总数、单个客户端等待中的请求数、
+# 单个客户端同时显示的窗口数（超出时在该客户端的队列中按顺序等待）。
+# 默认每个客户端一次只显示一个窗口：同一个用户一次只能回答一个call dk，
+# 某个客户端的突发请求不会铺满屏幕，也不会挤占其他客户端的窗口
+MAX_PENDING = int(os.getenv("CALLDK_MAX_PENDING", "32"))
+MAX_PENDING_PER_CLIENT = int(os.getenv("CALLDK_MAX_PENDING_PER_CLIENT", "8"))
+MAX_WINDOWS_PER_CLIENT = int(os.getenv("CALLDK_MAX_WINDOWS_PER_CLIENT", "1"))
+
+# 取消检查间隔（秒），等待界面结果的线程按此间隔检查请求是否已被取消
+CANCEL_POLL_INTERVAL = 0.1
+
+# 默认的等待截止时间（秒），0表示一直等待；call_dk工具的timeout_seconds参数可按次覆盖
+DEFAULT_TIMEOUT = float(os.getenv("CALLDK_DEFAULT_TIMEOUT", "0"))
+
+# 等待期间发送MCP进度通知的间隔（秒）
+PROGRESS_INTERVAL = float(os.getenv("CALLDK_PROGRESS_INTERVAL", "10"))
+
+# 图片交付方式：inline（图片直接内联在工具结果中）或 resource（结果只包含资源链接和缩略图，
+# 客户端按需通过 calldk://images/{sha256}.{格式} 读取原图）；call_dk工具的image_delivery参数可按次覆盖
+IMAGE_DELIVERY = os.getenv("CALLDK_IMAGE_DELIVERY", "inline").lower()
+IMAGE_DELIVERIES = ("inline", "resource")
+
+# 可回传给客户端的图片格式，每种格式注册一个资源模板以返回正确的MIME类型
+IMAGE_RESOURCE_FORMATS = ('jpeg', 'png', 'gif', 'bmp', 'webp', 'avif')
+
+# 图片对象缓存的总大小上限（字节，含base64编码后的内容），0表示不缓存
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("CALLDK_IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# 进度回调，接收宿主的ready（本次调用启动了宿主进程时）、progress和done帧头
+ProgressCallback = Callable[[dict], None]
+
+def _attach_shared_memory(name: str):
+    """附加到界面宿主创建的共享内存，生命周期由宿主负责"""
+    from multiprocessing import shared_memory
 
     try:
-        # 获取相对于此脚本的 calldk_ui.py 路径
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        calldk_ui_path = os.path.join(script_dir, "calldk_ui.py")
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            # 避免本进程的resource_tracker在退出时重复清理宿主的共享内存
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+class CalldkUIHost:
+    """
+    call dk界面宿主进程管理器
 
-        # 作为单独进程运行 calldk_ui.py
+    惰性启动 calldk_ui.py --host，之后的调用复用同一个进程
+    和预先构建好的窗口，通过stdin/stdout上的长度前缀帧进行通信。
+
+    多个请求可以同时进行：后台读取线程按帧头中的请求ID
+    将帧分发到各请求自己的队列，宿主为每个请求显示独立的窗口。
+    """
+
+    def __init__(self, script_path: str):
+        self.script_path = script_path
+        self._process = None
+        self._lock = threading.Lock()  # 保护宿主进程的启动和请求表
+        self._write_lock = threading.Lock()  # 多个请求线程共用stdin写入
+        self._pending: Dict[int, queue.Queue] = {}  # 请求ID -> 该请求的帧队列
+        self._next_id = 0
+
+    def _is_running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _start(self) -> dict:
         # 注意：uv 中似乎存在一个错误，所以我们需要
         # 传递一些特殊标志来使其正常工作
-        args = [
-            sys.executable,
-            "-u",
-            calldk_ui_path,
-            "--project-directory", project_directory,
-            "--prompt", summary,
-            "--output-file", output_file
-        ]
-        result = subprocess.run(
+        args = [sys.executable, "-u", self.script_path, "--host"]
+        process = subprocess.Popen(
             args,
-            check=False,
             shell=False,
-            stdout=subprocess.DEVNULL,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
             stderr=subprocess.DEVNULL,
-            stdin=subprocess.DEVNULL,
             close_fds=True
         )
-        if result.returncode != 0:
-            raise Exception(f"启动call dk界面失败: {result.returncode}")
+        self._process = process
+        frame = read_frame(process.stdout)
+        if frame is None or frame[0]["type"] != "ready":
+            self.stop()
+            raise Exception(f"call dk界面宿主启动失败: {frame[0] if frame else process.poll()}")
+
+        threading.Thread(target=self._read_loop, args=(process,), name="calldk-ui-host-reader", daemon=True).start()
+        return frame[0]
+
+    def _read_loop(self, process: subprocess.Popen):
+        """按请求ID分发宿主发来的帧，通道关闭时通知所有等待中的请求"""
+        try:
+            while True:
+                frame = read_frame(process.stdout)
+                if frame is None:
+                    break
+                with self._lock:
+                    frames = self._pending.get(frame[0].get("id"))
+                # 已取消或已结束的请求的帧直接丢弃
+                if frames is not None:
+                    frames.put(frame)
+        except (OSError, ValueError, FrameError):
+            pass
+
+        # 通道已不可用，结束宿主进程，下次调用会重新启动
+        if process.poll() is None:
+            process.kill()
+        with self._lock:
+            pending = list(self._pending.values())
+        for frames in pending:
+            frames.put(({"type": "error", "message": f"call dk界面宿主已退出: {process.poll()}"}, b""))
+
+    def _send(self, header: dict):
+        with self._write_lock:
+            write_frame(self._process.stdin, header)
+
+    def _next_frame(self, frames: queue.Queue, cancel_event: Optional[threading.Event],
+                    deadline: Optional[float]) -> Optional[Tuple[dict, bytes]]:
+        """
+        等待下一帧；cancel_event被设置时返回None
+
+        Raises:
+            TimeoutError: 超过截止时间（time.monotonic()）
+        """
+        while cancel_event is None or not cancel_event.is_set():
+            wait = CANCEL_POLL_INTERVAL if cancel_event is not None else None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("call dk等待超时")
+                wait = remaining if wait is None else min(wait, remaining)
+            try:
+                return frames.get(timeout=wait)
+            except queue.Empty:
+                pass
+        return None
+
+    def request(self, project_directory: str, summary: str, image_policy: ImagePolicy,
+                progress_callback: Optional[ProgressCallback] = None,
+                cancel_event: Optional[threading.Event] = None,
+                label: str = "", timeout: float = 0) -> Iterator[Tuple[dict, bytes]]:
+        """
+        显示界面并按到达顺序逐帧产出结果
+
+        产出text帧和image帧（图片帧的负载为原始图片字节），
+        收到done帧时结束；收到error帧时抛出异常。
+        cancel_event被设置、超过timeout秒或调用方提前关闭生成器时，
+        通知宿主关闭本次请求的窗口；超时时抛出TimeoutError。
+        """
+        deadline = time.monotonic() + timeout if timeout > 0 else None
+        ready = None
+        with self._lock:
+            if not self._is_running():
+                ready = self._start()
+            self._next_id += 1
+            request_id = self._next_id
+            frames = queue.Queue()
+            self._pending[request_id] = frames
+
+        if ready and progress_callback:
+            progress_callback(ready)
+
+        finished = False
+        try:
+            self._send({
+                "type": "show",
+                "id": request_id,
+                "project_directory": project_directory,
+                "prompt": summary,
+                "image_transport": IMAGE_TRANSPORT,
+                "image_policy": image_policy,
+                "label": label,
+                "timeout_seconds": timeout
+            })
+            while True:
+                frame = self._next_frame(frames, cancel_event, deadline)
+                if frame is None:
+                    return
+                header, payload = frame
+                frame_type = header["type"]
+                if frame_type in ("progress", "done") and progress_callback:
+                    progress_callback(header)
+                if frame_type == "done":
+                    finished = True
+                    return
+                if frame_type == "error":
+                    finished = True
+                    raise Exception(f"call dk界面返回错误: {header.get('message', '')}")
+                if frame_type == "image_manifest":
+                    yield from self._read_shared_memory_images(request_id, header)
+                elif frame_type in ("text", "image"):
+                    yield header, payload
+        except TimeoutError:
+            # TimeoutError是OSError的子类：超时只关闭本次请求的窗口，不影响宿主进程和其他窗口
+            raise
+        except OSError:
+            # 通信通道损坏时丢弃宿主进程，下次调用会重新启动
+            finished = True
+            self.stop()
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            if not finished:
+                self._cancel(request_id)
+
+    def _cancel(self, request_id: int):
+        """通知宿主关闭请求对应的窗口，不再回传结果"""
+        try:
+            self._send({"type": "cancel", "id": request_id})
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def _read_shared_memory_images(self, request_id: int, manifest: dict) -> Iterator[Tuple[dict, bytes]]:
+        shm = _attach_shared_memory(manifest["shm_name"])
+        try:
+            images = [
+                (
+                    {"type": "image", "filename": entry["filename"], "mime_type": entry["mime_type"],
+                     "sha256": entry.get("sha256")},
+                    bytes(shm.buf[entry["offset"]:entry["offset"] + entry["length"]])
+                )
+                for entry in manifest["images"]
+            ]
+        finally:
+            shm.close()
+            # 通知宿主可以释放共享内存
+            self._send({"type": "release", "id": request_id})
+        yield from images
+
+    def stop(self):
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            if process.poll() is None:
+                process.stdin.close()
+                process.wait(timeout=3)
+        except Exception:
+            process.kill()
+
+_ui_host = CalldkUIHost(CALLDK_UI_PATH)
+atexit.register(_ui_host.stop)
+
+class ClientRequestLimiter:
+    """
+    按客户端排队并限制等待中的请求数
+
+    所有方法都在服务器的事件循环中调用，不需要额外加锁。
+    """
+
+    def __init__(self, max_pending: int, max_pending_per_client: int, max_windows_per_client: int):
+        self.max_pending = max_pending
+        self.max_pending_per_client = max_pending_per_client
+        self.max_windows_per_client = max_windows_per_client
+        self._pending = 0
+        self._client_pending: Dict[str, int] = {}
+        self._client_slots: Dict[str, anyio.Semaphore] = {}  # 客户端 -> 同时显示窗口数的信号量
+
+    @asynccontextmanager
+    async def slot(self, client_key: str, timeout: float = 0) -> AsyncIterator[None]:
+        """
+        占用一个请求名额，超出单客户端窗口数时按到达顺序等待
+
+        Raises:
+            ToolError: 等待中的请求数已达上限
+            TimeoutError: 排队超过timeout秒（0表示一直等待）
+        """
+        if self.max_pending and self._pending >= self.max_pending:
+            raise ToolError(f"call dk等待中的请求过多（上限{self.max_pending}），请稍后重试")
+        client_pending = self._client_pending.get(client_key, 0)
+        if self.max_pending_per_client and client_pending >= self.max_pending_per_client:
+            raise ToolError(f"当前客户端等待中的call dk请求过多（上限{self.max_pending_per_client}），请稍后重试")
+
+        self._pending += 1
+        self._client_pending[client_key] = client_pending + 1
+        try:
+            if self.max_windows_per_client:
+                slots = self._client_slots.setdefault(client_key, anyio.Semaphore(self.max_windows_per_client))
+                with anyio.fail_after(timeout or None):
+                    await slots.acquire()
+                try:
+                    yield
+                finally:
+                    slots.release()
+            else:
+                yield
+        finally:
+            self._pending -= 1
+            self._client_pending[client_key] -= 1
+            if not self._client_pending[client_key]:
+                del self._client_pending[client_key]
+                self._client_slots.pop(client_key, None)
+
+# 调用指标输出（CALLDK_METRICS_FILE / CALLDK_METRICS_PROM_FILE）
+_metrics_recorder = MetricsRecorder.from_environment()
+
+_request_limiter = ClientRequestLimiter(MAX_PENDING, MAX_PENDING_PER_CLIENT, MAX_WINDOWS_PER_CLIENT)
+
+def _client_identity(ctx: Context) -> Tuple[str, str]:
+    """返回(排队用的客户端标识, 显示在窗口标题上的标签)"""
+    client_key = ctx.client_id or ctx.session_id
+    if TRANSPORT != "http":
+        # stdio下每个服务器进程只有一个客户端，无需标明来源
+        return client_key, ""
+
+    client_name = ""
+    try:
+        client_params = ctx.session.client_params
+        if client_params:
+            client_name = client_params.clientInfo.name
+    except Exception:
+        pass
+    return client_key, f"{client_name or 'client'} #{client_key[:8]}"
 
-        # 从临时文件读取结果
-        with open(output_file, 'r') as f:
-            result = json.load(f)
-        os.unlink(output_file)
+def _has_display() -> bool:
+    if sys.platform in ("win32", "darwin"):
+        return True
+    return bool(os.getenv("DISPLAY") or os.getenv("WAYLAND_DISPLAY") or os.getenv("QT_QPA_PLATFORM"))
 
-        # 处理结果以创建内容列表
-        content_list = []
+def _resolve_backend(backend: Optional[str]) -> str:
+    backend = (backend or BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的响应后端: {backend}，可选值: {', '.join(BACKENDS)}")
+    if backend == "auto":
+        return "qt" if _has_display() else "tty"
+    return backend
 
+def _request_tty(project_directory: str, summary: str, image_policy: ImagePolicy,
+                 progress_callback: Optional[ProgressCallback] = None, timeout: float = 0,
+                 cancel_event: Optional[threading.Event] = None) -> Iterator[Tuple[dict, bytes]]:
+    # 以与界面宿主相同的帧形式产出终端结果，共用内容列表的构建逻辑
+    if progress_callback:
+        progress_callback({"type": "progress", "stage": "shown"})
+    prompt_start = time.perf_counter()
+    result = tty_calldk(project_directory, summary, image_policy, timeout, cancel_event)
+    response_ms = (time.perf_counter() - prompt_start) * 1000
+
+    yield {"type": "text", "interactive_calldk": result["interactive_calldk"]}, b""
+    for image_data in result["images"]:
+        yield ({"type": "image", "filename": image_data["filename"], "mime_type": image_data["mime_type"],
+                "sha256": image_data.get("sha256")}, image_data["data"])
+    if progress_callback:
+        progress_callback({"type": "done", "image_count": len(result["images"]),
+                           "timings": {"response_ms": round(response_ms, 3)}})
+
+def _request_calldk(project_directory: str, summary: str, image_policy: ImagePolicy,
+                    progress_callback: Optional[ProgressCallback] = None,
+                    backend: Optional[str] = None,
+                    cancel_event: Optional[threading.Event] = None,
+                    label: str = "", timeout: float = 0) -> Iterator[Tuple[dict, bytes]]:
+    if _resolve_backend(backend) == "tty":
+        yield from _request_tty(project_directory, summary, image_policy, progress_callback, timeout, cancel_event)
+        return
+
+    if USE_UI_HOST:
+        yield from _ui_host.request(project_directory, summary, image_policy,
+                                    progress_callback, cancel_event, label, timeout)
+        return
+
+    # 冷启动模式：为本次调用单独启动一个界面进程，用完即退出
+    host = CalldkUIHost(CALLDK_UI_PATH)
+    try:
+        yield from host.request(project_directory, summary, image_policy,
+                                progress_callback, cancel_event, label, timeout)
+    finally:
+        host.stop()
+
+class _CachedImage(Image):
+    """记住转换后的MCP图片内容，同一图片再次回传时无需重新base64编码"""
+
+    def __init__(self, data: bytes, format: str):
+        super().__init__(data=data, format=format)
+        self.format_type = format
+        self._image_content = None
+
+    def to_image_content(self, mime_type=None, annotations=None):
+        if mime_type is not None or annotations is not None:
+            return super().to_image_content(mime_type, annotations)
+        if self._image_content is None:
+            self._image_content = super().to_image_content()
+        return self._image_content
+
+class ImageObjectCache:
+    """
+    按内容哈希缓存已构建的图片对象（LRU，按总大小淘汰）
+
+    用户在多次call dk中反复附加同一截图时复用同一个对象，
+    call_dk在多个线程中并发执行，所有操作持有锁。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Image, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, sha256: str) -> Optional[Image]:
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry is None:
+                return None
+            self._entries.move_to_end(sha256)
+            return entry[0]
+
+    def put(self, sha256: str, image: Image):
+        # 图片字节加上base64编码后的内容
+        size = len(image.data) + (len(image.data) + 2) // 3 * 4
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if sha256 in self._entries:
+                return
+            self._entries[sha256] = (image, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+_image_cache = ImageObjectCache(IMAGE_CACHE_MAX_BYTES)
+
+def _image_format(image_data: dict, image_bytes: bytes) -> str:
+    # 从mime_type中提取格式，例如从'image/jpeg'提取'jpeg'，从'image/png'提取'png'
+    format_type = image_data['mime_type'].split('/')[-1]
+
+    # 处理特殊格式
+    if format_type == 'jpg':
+        format_type = 'jpeg'
+    elif format_type not in IMAGE_RESOURCE_FORMATS:
+        # 未知的MIME类型按文件头识别真实格式，不再一律标记为png
+        format_type = sniff_image_format(image_bytes[:16])
+        if format_type not in IMAGE_RESOURCE_FORMATS:
+            raise ValueError(f"不支持的图片类型: {image_data['mime_type']}")
+    return format_type
+
+def _create_image(image_data: dict, image_bytes: bytes) -> Image:
+    format_type = _image_format(image_data, image_bytes)
+
+    # 相同内容的图片复用已构建的对象
+    sha256 = image_data.get('sha256') or image_sha256(image_bytes)
+    image = _image_cache.get(sha256)
+    if image is None:
+        image = _CachedImage(data=image_bytes, format=format_type)
+        _image_cache.put(sha256, image)
+    return image
+
+def _create_image_reference(image_data: dict, image_bytes: bytes) -> List[ContentBlock]:
+    """
+    构建图片的资源链接和缩略图，原图保留在图片对象缓存和图片存储中，客户端读取资源时才传输
+
+    图片存储中已有缩略图和尺寸时直接使用，否则在此生成并写入存储。
+    """
+    format_type = _image_format(image_data, image_bytes)
+    sha256 = image_data['sha256']
+    if _image_cache.get(sha256) is None:
+        _image_cache.put(sha256, _CachedImage(data=image_bytes, format=format_type))
+
+    store = get_image_store()
+    info = store.get_info(sha256) if store is not None else None
+    if info is None and store is not None:
+        store.put(image_bytes, image_data['mime_type'])
+        info = store.get_info(sha256)
+    if info is not None:
+        thumbnail, width, height = info['thumbnail'], info['width'], info['height']
+    else:
+        try:
+            thumbnail, width, height = make_thumbnail(image_bytes)
+        except Exception:
+            thumbnail, width, height = None, 0, 0
+
+    filename = image_data.get('filename') or sha256[:12]
+    content = [ResourceLink(
+        type="resource_link",
+        uri=f"calldk://images/{sha256}.{format_type}",
+        name=filename,
+        description=f"{filename}: {width}x{height}, {len(image_bytes)} 字节，读取此资源获取原图",
+        mimeType=f"image/{format_type}",
+        size=len(image_bytes)
+    )]
+    if thumbnail:
+        content.append(ImageContent(type="image", data=base64.b64encode(thumbnail).decode(), mimeType="image/jpeg"))
+    return content
+
+def _read_image_resource(sha256: str, format_type: str) -> bytes:
+    """按内容哈希读取原图，依次查找图片对象缓存和图片存储；请求的格式必须与图片的实际格式一致"""
+    image = _image_cache.get(sha256)
+    if image is not None:
+        # 同一哈希只对应一种编码，格式不符时不能以请求的MIME类型返回缓存的字节
+        if image.format_type != format_type:
+            raise ResourceError(f"图片 {sha256} 的格式不是 {format_type}")
+        return image.data
+    store = get_image_store()
+    stored = store.get(sha256) if store is not None else None
+    if stored is None or _image_format(stored, stored['data']) != format_type:
+        raise ResourceError(f"图片 {sha256} 不存在或已被淘汰")
+    return stored['data']
+
+def _register_image_resources():
+    for format_type in IMAGE_RESOURCE_FORMATS:
+        def read_image(sha256: str, format_type: str = format_type) -> bytes:
+            return _read_image_resource(sha256, format_type)
+
+        mcp.resource(
+            f"calldk://images/{{sha256}}.{format_type}",
+            name=f"calldk_image_{format_type}",
+            description="call dk回传的图片原图（以内容哈希标识）",
+            mime_type=f"image/{format_type}"
+        )(read_image)
+
+_register_image_resources()
+
+def _to_content_blocks(content_list: List[Union[str, Image, ContentBlock]]) -> List[ContentBlock]:
+    # 逐项转换为MCP内容，避免fastmcp将不含ContentBlock的列表整体序列化为一段文本
+    blocks = []
+    for item in content_list:
+        if isinstance(item, str):
+            blocks.append(TextContent(type="text", text=item))
+        elif isinstance(item, Image):
+            blocks.append(item.to_image_content())
+        else:
+            blocks.append(item)
+    return blocks
+
+def _resolve_image_delivery(image_delivery: Optional[str]) -> str:
+    image_delivery = (image_delivery or IMAGE_DELIVERY).lower()
+    if image_delivery not in IMAGE_DELIVERIES:
+        raise ValueError(f"未知的图片交付方式: {image_delivery}，可选值: {', '.join(IMAGE_DELIVERIES)}")
+    return image_delivery
+
+def _timeout_result(timeout: float) -> str:
+    # 超时时返回给智能体的固定格式结果，便于据此决定是否继续
+    return f"call dk超时: 用户未在{round(timeout, 1):g}秒内响应，未收到call dk内容"
+
+def _append_content(content_list: List[Union[str, Image, ContentBlock]], header: dict, payload: bytes,
+                    metrics: CallMetrics, seen_images: set, image_delivery: str = "inline"):
+    if header["type"] == "text":
         # 如果有文本call dk则添加
-        calldk_text = result.get('interactive_calldk', '').strip()
-        command_logs = result.get('command_logs', '').strip()
+        calldk_text = header.get('interactive_calldk', '').strip()
+        metrics.on_text(calldk_text)
+        command_logs = header.get('command_logs', '').strip()
 
         # 将call dk和日志合并为单个文本响应
         combined_text = ""
@@ -68,44 +603,175 @@ def launch_calldk_ui(project_directory: str, summary: str) -> List[Union[str, Im
 
         if combined_text.strip():
             content_list.append(combined_text.strip())
+    else:
+        # 如果有图片则添加，同一结果中内容相同的图片只保留一张
+        decode_start = time.perf_counter()
+        if not header.get('sha256'):
+            header = dict(header, sha256=image_sha256(payload))
+        if header['sha256'] in seen_images:
+            return
+        seen_images.add(header['sha256'])
+        try:
+            if image_delivery == "resource":
+                content_list.extend(_create_image_reference(header, payload))
+            else:
+                content_list.append(_create_image(header, payload))
+        except Exception as e:
+            # 如果图片处理失败，添加错误消息
+            content_list.append(f"图片处理错误 ({header.get('filename', '')}): {str(e)}")
+        metrics.on_image(header.get('mime_type', ''), len(payload), (time.perf_counter() - decode_start) * 1000)
 
-        # 如果有图片则添加
-        images = result.get('images', [])
-        for image_data in images:
-            try:
-                # 将base64数据转换回字节
-                image_bytes = base64.b64decode(image_data['data'])
-                
-                # 从mime_type中提取格式，例如从'image/jpeg'提取'jpeg'，从'image/png'提取'png'
-                format_type = image_data['mime_type'].split('/')[-1]
-
-                # 处理特殊格式
-                if format_type == 'jpg':
-                    format_type = 'jpeg'
-                elif format_type not in ('jpeg', 'png', 'gif', 'bmp', 'webp'):
-                    format_type = 'png'  # 默认使用png格式
-
-                # 创建 fastmcp Image 对象
-                img = Image(data=image_bytes, format=format_type)
-                content_list.append(img)
-            except Exception as e:
-                # 如果图片处理失败，添加错误消息
-                content_list.append(f"图片处理错误 ({image_data['filename']}): {str(e)}")
-
-        return content_list
+def launch_calldk_ui(project_directory: str, summary: str, image_policy: Optional[ImagePolicy] = None,
+                     progress_callback: Optional[ProgressCallback] = None,
+                     backend: Optional[str] = None,
+                     cancel_event: Optional[threading.Event] = None,
+                     label: str = "", timeout: Optional[float] = None,
+                     image_delivery: Optional[str] = None,
+                     requested_timeout: Optional[float] = None) -> List[Union[str, Image, ContentBlock]]:
+    # 未指定时使用.env中配置的图片负载预算、截止时间和图片交付方式
+    if image_policy is None:
+        image_policy = load_image_policy()
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+    # timeout可能是扣除排队时间后的剩余预算，超时结果中报告调用方请求的时间
+    if requested_timeout is None:
+        requested_timeout = timeout
+    image_delivery = _resolve_image_delivery(image_delivery)
+
+    metrics = CallMetrics(_resolve_backend(backend), IMAGE_TRANSPORT, label)
+
+    def on_progress(header: dict):
+        metrics.on_frame(header)
+        if progress_callback:
+            progress_callback(header)
 
+    # 处理结果以创建内容列表，帧到达时即开始构建
+    content_list = []
+    seen_images = set()
+
+    try:
+        for header, payload in _request_calldk(project_directory, summary, image_policy,
+                                               on_progress, backend, cancel_event, label, timeout):
+            _append_content(content_list, header, payload, metrics, seen_images, image_delivery)
+    except TimeoutError:
+        metrics.finish("timeout")
+        _metrics_recorder.record(metrics)
+        return [_timeout_result(requested_timeout)]
     except Exception as e:
-        if os.path.exists(output_file):
-            os.unlink(output_file)
-        raise e
+        metrics.finish("error", str(e))
+        _metrics_recorder.record(metrics)
+        raise
+
+    metrics.finish("cancelled" if cancel_event is not None and cancel_event.is_set() else "ok")
+    _metrics_recorder.record(metrics)
+    return content_list
+
+async def launch_calldk_ui_async(project_directory: str, summary: str, image_policy: Optional[ImagePolicy] = None,
+                                 progress_callback: Optional[ProgressCallback] = None,
+                                 backend: Optional[str] = None,
+                                 label: str = "", timeout: Optional[float] = None,
+                                 image_delivery: Optional[str] = None,
+                                 requested_timeout: Optional[float] = None) -> List[Union[str, Image, ContentBlock]]:
+    """
+    launch_calldk_ui的异步版本，等待用户响应期间不阻塞事件循环
+
+    调用被取消（例如客户端发送MCP取消通知）时关闭本次请求的窗口，终端后端放弃输入并释放终端。
+    """
+    cancel_event = threading.Event()
+    try:
+        return await anyio.to_thread.run_sync(
+            lambda: launch_calldk_ui(project_directory, summary, image_policy,
+                                     progress_callback, backend, cancel_event, label, timeout, image_delivery,
+                                     requested_timeout),
+            abandon_on_cancel=True
+        )
+    except anyio.get_cancelled_exc_class():
+        cancel_event.set()
+        raise
 
 def first_line(text: str) -> str:
     return text.split("\n")[0].strip()
 
+async def _report_waiting_progress(ctx: Context, timeout: float, status: dict):
+    """等待期间定期发送MCP进度通知，客户端可据此显示状态或重置请求超时"""
+    start = time.monotonic()
+    while True:
+        await anyio.sleep(PROGRESS_INTERVAL)
+        elapsed = time.monotonic() - start
+        message = status["message"]
+        if timeout > 0:
+            message += f"，剩余{max(timeout - elapsed, 0):.0f}秒"
+        try:
+            await ctx.report_progress(progress=elapsed, total=timeout or None, message=message)
+        except Exception:
+            return
+
 @mcp.tool()
-def call_dk() -> List[Union[str, Image]]:
-    """呼叫dk"""
-    return launch_calldk_ui(".", "call dk")
+async def call_dk(ctx: Context, backend: Optional[str] = None,
+                  timeout_seconds: Optional[float] = None,
+                  image_delivery: Optional[str] = None,
+                  accepted_image_formats: Optional[List[str]] = None) -> List[ContentBlock]:
+    """呼叫dk
+
+    Args:
+        backend: 响应后端，qt（图形界面）、tty（控制终端）或auto，默认使用CALLDK_BACKEND
+        timeout_seconds: 等待用户响应的最长时间（秒），超时返回"call dk超时"结果；
+            默认使用CALLDK_DEFAULT_TIMEOUT，0表示一直等待
+        image_delivery: 图片交付方式，inline（内联原图）或resource（资源链接和缩略图，按需读取原图），
+            默认使用CALLDK_IMAGE_DELIVERY
+        accepted_image_formats: 客户端可接受的图片格式（如["png", "jpeg", "webp"]），
+            界面按CALLDK_IMAGE_ENCODING选择其中最紧凑的编码；默认使用CALLDK_CLIENT_IMAGE_FORMATS
+    """
+    client_key, label = _client_identity(ctx)
+    timeout = DEFAULT_TIMEOUT if timeout_seconds is None else max(timeout_seconds, 0)
+    try:
+        _resolve_backend(backend)
+        image_delivery = _resolve_image_delivery(image_delivery)
+    except ValueError as e:
+        raise ToolError(str(e))
+    image_policy = load_image_policy(accepted_image_formats)
+    unsupported = [f for f in image_policy['accepted_formats'] if f not in IMAGE_RESOURCE_FORMATS]
+    if unsupported:
+        raise ToolError(f"不支持的图片格式: {', '.join(unsupported)}，可选值: {', '.join(IMAGE_RESOURCE_FORMATS)}")
+    start = time.monotonic()
+    status = {"message": "排队等待中"}
+
+    def on_progress(header: dict):
+        if header.get("type") == "progress" and header.get("stage") == "shown":
+            status["message"] = "等待用户响应"
+
+    try:
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(_report_waiting_progress, ctx, timeout, status)
+            try:
+                async with _request_limiter.slot(client_key, timeout):
+                    # 截止时间包含排队时间
+                    remaining = max(timeout - (time.monotonic() - start), 0.001) if timeout > 0 else 0
+                    return _to_content_blocks(await launch_calldk_ui_async(
+                        ".", "call dk", image_policy, progress_callback=on_progress, backend=backend,
+                        label=label, timeout=remaining, image_delivery=image_delivery,
+                        requested_timeout=timeout
+                    ))
+            except TimeoutError:
+                return _to_content_blocks([_timeout_result(timeout)])
+            finally:
+                task_group.cancel_scope.cancel()
+    except ExceptionGroup as group:
+        # 任务组把异常包装为ExceptionGroup；进度通知任务不会抛出异常，还原本次调用的原始异常，
+        # 使客户端看到ToolError等的错误信息
+        if len(group.exceptions) == 1:
+            raise group.exceptions[0] from None
+        raise
 
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    parser = argparse.ArgumentParser(description="dk call mcp server")
+    parser.add_argument("--transport", choices=("stdio", "http"), default=TRANSPORT, help="MCP传输方式")
+    parser.add_argument("--host", default=HTTP_HOST, help="http传输监听的地址")
+    parser.add_argument("--port", type=int, default=HTTP_PORT, help="http传输监听的端口")
+    args = parser.parse_args()
+
+    if args.transport == "http":
+        TRANSPORT = "http"
+        mcp.run(transport="http", host=args.host, port=args.port)
+    else:
+        mcp.run(transport="stdio")
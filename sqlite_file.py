@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+本地SQLite文件
+优化结果缓存和图片存储共用的连接逻辑：每次操作使用独立连接，首次连接时创建目录、启用WAL并建表
+"""
+
+import os
+import sqlite3
+from typing import Sequence
+
+class SQLiteFile:
+    """
+    按需打开的SQLite文件
+
+    每次调用connect()都返回新的连接，可在多个线程和进程中并发使用；
+    首次连接时准备好目录和表结构，出错时由调用方处理sqlite3.Error/OSError。
+    """
+
+    def __init__(self, path: str, schema: Sequence[str]):
+        self.path = path
+        self.schema = schema  # 首次连接时执行的建表语句
+        self._ready = False
+
+    def connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            # 首次使用时目录可能还不存在，sqlite3.connect不会自动创建
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.schema:
+                conn.execute(statement)
+            conn.commit()
+            self._ready = True
+        return conn
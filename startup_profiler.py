@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+启动性能分析模块
+记录界面进程各启动阶段的耗时，并以JSON行的形式输出
+"""
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+class StartupProfiler:
+    """
+    启动阶段耗时记录器
+
+    通过环境变量CALLDK_PROFILE_STARTUP或命令行参数--profile-startup启用，
+    取值为1/true时输出到stderr，其他取值视为输出文件路径（追加写入）。
+    CALLDK_STARTUP_BUDGET_MS设置首次绘制的时间预算，超出时在报告中标记。
+    """
+
+    def __init__(self, output: Optional[str] = None, budget_ms: float = 0):
+        self.origin = time.perf_counter()
+        self.wall_start = time.time()
+        self.output = output  # None表示未启用
+        self.budget_ms = budget_ms
+        self.stages: Dict[str, float] = {}  # 阶段名 -> 耗时（毫秒）
+        self.marks: Dict[str, float] = {}  # 事件名 -> 距启动的时间（毫秒）
+        self.reported = False
+
+    @classmethod
+    def from_environment(cls, argv=None) -> "StartupProfiler":
+        argv = sys.argv if argv is None else argv
+        output = os.getenv("CALLDK_PROFILE_STARTUP", "").strip() or None
+        if "--profile-startup" in argv:
+            index = argv.index("--profile-startup")
+            value = argv[index + 1] if index + 1 < len(argv) else ""
+            output = value if value and not value.startswith("--") else "1"
+        elif output and output.lower() in ("0", "false"):
+            output = None
+        return cls(output, float(os.getenv("CALLDK_STARTUP_BUDGET_MS", "0")))
+
+    @property
+    def enabled(self) -> bool:
+        return self.output is not None
+
+    def _elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.origin) * 1000
+
+    @contextmanager
+    def measure(self, stage: str):
+        """记录一个阶段的耗时，同名阶段累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+    def mark(self, event: str):
+        """记录一个事件发生的时间点，同名事件只记录第一次"""
+        self.marks.setdefault(event, self._elapsed_ms())
+
+    def report(self, final_mark: str = "first_paint"):
+        """输出报告，每个进程只输出一次"""
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+
+        total_ms = self.marks.get(final_mark, self._elapsed_ms())
+        report = {
+            "event": "calldk_startup",
+            "pid": os.getpid(),
+            "wall_start": self.wall_start,
+            "total_ms": round(total_ms, 2),
+            "stages": {name: round(ms, 2) for name, ms in self.stages.items()},
+            "marks": {name: round(ms, 2) for name, ms in self.marks.items()},
+        }
+        if self.budget_ms > 0:
+            report["budget_ms"] = self.budget_ms
+            report["over_budget"] = total_ms > self.budget_ms
+
+        line = json.dumps(report, ensure_ascii=False)
+        try:
+            if self.output.lower() in ("1", "true"):
+                print(line, file=sys.stderr, flush=True)
+            else:
+                with open(self.output, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            print(f"写入启动性能报告失败: {e}", file=sys.stderr)
+
+        if report.get("over_budget"):
+            print(f"启动耗时 {total_ms:.0f} ms 超出预算 {self.budget_ms:.0f} ms", file=sys.stderr)